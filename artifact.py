@@ -0,0 +1,168 @@
+# artifact.py
+# Versioned on-disk format for a trained model + preprocessor.
+#
+#   <dir>/manifest.json            format version, model/preproc version ids, config,
+#                                  category maps, array index
+#   <dir>/model.txt                LightGBM native model
+#   <dir>/tfidf_vocabulary.npy     terms, ordered by column (or tfidf_columns.npy,
+#                                  the kept hash buckets, for a streaming fit)
+#   <dir>/tfidf_idf.npy
+#   <dir>/svd_components.npy
+#   <dir>/sim_vectors.npy          L2-normalized float32 training vectors (int8 codes
+#                                  plus sim_scales.npy for an int8 index)
+#   <dir>/sim_*.npy                IVF lists (approximate index only)
+#   <dir>/cat_bitsets_<i>.npy      category index, one file per cat column
+#
+# Large arrays are loaded as read-only memmaps, so loading only reads the
+# manifest and the text model, and every worker on the host shares the
+# same pages through the OS page cache. Training frames (X_full_df,
+# X_tfidf_matrix, X_svd_array) are not part of the artifact.
+import os
+import json
+import shutil
+import time
+import numpy as np
+import lightgbm as lgb
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
+from category_encoder import CategoryEncoder
+from preprocessing import HashingTfidfVectorizer
+from similarity import get_similarity_index, get_category_index
+from similarity_index import SimilarityIndex, CategoryIndex
+from predictor import model_version
+
+ARTIFACT_FORMAT_VERSION = 1
+
+_JSON_TYPES = (str, int, float, bool, type(None), list, tuple)
+
+def save_artifact(model, preproc, path="price_model_artifact"):
+    """Write model + preprocessor as an artifact directory (replaced atomically)."""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    booster = getattr(model, 'booster_', model)
+    # LightGBM cannot parse a list-valued categorical_feature parameter back
+    # in; the trees and pandas_categorical already carry that information
+    model_lines = [line for line in booster.model_to_string().split("\n")
+                   if not line.startswith("[categorical_feature:")]
+    with open(os.path.join(tmp_path, "model.txt"), "w") as f:
+        f.write("\n".join(model_lines))
+
+    tfidf, svd = preproc['tfidf'], preproc['svd']
+    arrays = {
+        'tfidf_idf': np.asarray(tfidf.idf_),
+        'svd_components': np.asarray(svd.components_),
+    }
+    if isinstance(tfidf, HashingTfidfVectorizer):
+        arrays['tfidf_columns'] = tfidf.columns_
+        tfidf_params = {'max_features': tfidf.max_features,
+                        'ngram_range': list(tfidf.ngram_range),
+                        'n_buckets': tfidf.n_buckets}
+    else:
+        vocab = np.empty(len(tfidf.vocabulary_), dtype=object)
+        for term, col in tfidf.vocabulary_.items():
+            vocab[col] = term
+        arrays['tfidf_vocabulary'] = vocab.astype(str)
+        tfidf_params = {k: v for k, v in tfidf.get_params().items() if isinstance(v, _JSON_TYPES)}
+
+    sim_index = get_similarity_index(preproc)
+    if sim_index.scales is not None:
+        arrays['sim_vectors'] = np.ascontiguousarray(sim_index.vectors, dtype=np.int8)
+        arrays['sim_scales'] = sim_index.scales
+    else:
+        arrays['sim_vectors'] = np.ascontiguousarray(sim_index.vectors, dtype=np.float32)
+    if sim_index.centroids is not None:
+        arrays['sim_centroids'] = sim_index.centroids
+        arrays['sim_list_rows'] = sim_index.list_rows
+        arrays['sim_list_offsets'] = sim_index.list_offsets
+
+    cat_index = get_category_index(preproc)
+    for i, bits in enumerate(cat_index.bitsets):
+        arrays[f'cat_bitsets_{i}'] = bits
+
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), arr, allow_pickle=False)
+
+    model_version(model, preproc)
+    manifest = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'version': {'model': model.version_, 'preproc': preproc['version']},
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cat_cols': preproc['cat_cols'],
+        'cat_maps': preproc['cat_maps'],
+        'tfidf_kind': 'hashing' if isinstance(tfidf, HashingTfidfVectorizer) else 'vocabulary',
+        'tfidf_params': tfidf_params,
+        'sim_index': {'mode': sim_index.mode, 'n_probe': sim_index.n_probe,
+                      'precision': sim_index.precision},
+        'n_train_rows': int(cat_index.n_rows),
+        'val_metrics': {k: float(v) for k, v in (getattr(model, 'val_metrics_', None) or {}).items()},
+        'arrays': sorted(arrays),
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    # swap the finished directory into place
+    if os.path.exists(path):
+        old_path = f"{path}.old-{os.getpid()}"
+        os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    else:
+        os.rename(tmp_path, path)
+    print(f"✅ Model artifact saved at {path}")
+
+def load_artifact(path="price_model_artifact"):
+    """Load (model, preproc) from an artifact directory; arrays are memory-mapped."""
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != ARTIFACT_FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format version: {manifest.get('format_version')}")
+
+    def array(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r', allow_pickle=False)
+
+    model = lgb.Booster(model_file=os.path.join(path, "model.txt"))
+    model.val_metrics_ = manifest.get('val_metrics') or None
+    version = manifest.get('version') or {}
+    model.version_ = version.get('model')
+
+    params = dict(manifest['tfidf_params'])
+    params['ngram_range'] = tuple(params['ngram_range'])
+    if manifest.get('tfidf_kind') == 'hashing':
+        tfidf = HashingTfidfVectorizer.from_fitted(array('tfidf_columns'), array('tfidf_idf'), **params)
+    else:
+        tfidf = TfidfVectorizer(**params)
+        tfidf.vocabulary_ = {str(term): i for i, term in enumerate(array('tfidf_vocabulary'))}
+        tfidf.idf_ = np.asarray(array('tfidf_idf'))
+
+    components = array('svd_components')
+    svd = TruncatedSVD(n_components=components.shape[0])
+    svd.components_ = components
+    svd.n_features_in_ = components.shape[1]
+
+    arrays = set(manifest['arrays'])
+    sim = manifest['sim_index']
+    ivf = {k: array(f'sim_{k}') for k in ('centroids', 'list_rows', 'list_offsets', 'scales')
+           if f'sim_{k}' in arrays}
+    sim_index = SimilarityIndex.from_arrays(array('sim_vectors'), mode=sim['mode'],
+                                            n_probe=sim['n_probe'], **ivf)
+
+    cat_cols = manifest['cat_cols']
+    cat_index = CategoryIndex.from_bitsets(
+        [array(f'cat_bitsets_{i}') for i in range(len(cat_cols))], manifest['n_train_rows']
+    )
+
+    preproc = {
+        'tfidf': tfidf,
+        'svd': svd,
+        'cat_cols': cat_cols,
+        'cat_maps': manifest['cat_maps'],
+        'cat_encoder': CategoryEncoder.from_cat_maps(cat_cols, manifest['cat_maps']),
+        'sim_index': sim_index,
+        'cat_index': cat_index,
+        'version': version.get('preproc'),
+    }
+    print("✅ Model artifact loaded successfully")
+    return model, preproc
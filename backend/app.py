@@ -1,8 +1,12 @@
 import os
 import json
+import asyncio
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Set
 import re # <-- ADD THIS IMPORT AT THE TOP
+import uuid
+import time
+import hmac
 
 # --- Environment and Configuration ---
 from dotenv import load_dotenv
@@ -11,14 +15,25 @@ load_dotenv()
 # --- Third-Party Imports ---
 import google.generativeai as genai
 from supabase import create_client, Client
-from deep_translator import GoogleTranslator
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import PIL.Image
 import io
 
+from services.blocking_io import BlockingIO
+from services.broker import make_broker
+from services.connection import ClientConnection
+from services.conversation_cache import ConversationCache
+from services.message_writer import MessageWriter
+from services.history_compactor import HistoryCompactor
+from services.translation import TranslationService, GoogleBackend, StubBackend
+from services.model_registry import ModelRegistry
+from services.price_batcher import PriceBatcher
+from services.predictor import PredictionCache, normalize_row, prediction_key
+from services.data_utils import CAT_COLS
+
 # --- 1. Client Setup (Supabase, AI) ---
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -40,9 +55,13 @@ class OutgoingMessage(BaseModel):
     timestamp: str = Field(default_factory=lambda: datetime.utcnow().isoformat())
 
 class AiSuggestion(BaseModel):
+    # "suggestion" carries the full text; when streaming it is preceded by
+    # "suggestion_delta" frames (text = next chunk) with the same suggestion_id,
+    # or ended early by a "suggestion_cancelled" frame
     type: str = "suggestion"
     conversation_id: str
     text: str
+    suggestion_id: Optional[str] = None
 
 class ListingResponse(BaseModel):
     title: str
@@ -50,6 +69,24 @@ class ListingResponse(BaseModel):
     tags: List[str]
     suggested_price: str
 
+class PriceRequest(BaseModel):
+    product_type: str
+    material: str
+    color: str
+    style: str
+    region: str
+    description: str = ""
+
+class PriceResponse(BaseModel):
+    predicted_price: float
+    max_cat_matches: int
+    max_text_similarity: Optional[float] = None
+
+class ModelReloadRequest(BaseModel):
+    # name of an artifact directory inside PRICE_MODEL_DIR, never a path
+    version: str
+    segment: Optional[str] = None
+
 
 # --- 3. FastAPI Application ---
 app = FastAPI(title="KalaSetu AI Chat Backend")
@@ -76,88 +113,351 @@ app.add_middleware(
 
 # --- 4. WebSocket Connection Manager & Logic ---
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
-    async def connect(self, user_id: str, websocket: WebSocket):
+    """
+    Websockets held by this worker (several per user, e.g. one per tab).
+    Frames go through the broker, which delivers them on whichever workers
+    hold the recipient's connections (see services/broker.py). Each socket
+    has its own send queue and writer task (services/connection.py), so
+    delivering never waits on a recipient's network. Every
+    heartbeat_interval seconds each connection gets a {"type": "ping"}
+    frame; clients that answered one with {"type": "pong"} are closed once
+    they go quiet for longer than their idle timeout. The heartbeat also
+    renews this worker's presence in the broker.
+    """
+    def __init__(self, broker, heartbeat_interval: float = 20.0, **connection_options):
+        self.broker = broker
+        self.heartbeat_interval = heartbeat_interval
+        self.connection_options = connection_options
+        self.active_connections: Dict[str, Set[ClientConnection]] = {}
+        self._heartbeat = None
+        self.evicted = 0
+    async def start(self):
+        await self.broker.start(self.deliver_local)
+        self._heartbeat = asyncio.create_task(self.heartbeat())
+    async def connect(self, user_id: str, websocket: WebSocket) -> ClientConnection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
-        print(f"User {user_id} connected.")
-    def disconnect(self, user_id: str):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            print(f"User {user_id} disconnected.")
-    async def send_json(self, user_id: str, data: dict):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_json(data)
-
-manager = ConnectionManager()
-
-def translate_text(text: str, target_language: str) -> str:
-    if not text or not target_language: return ""
-    try:
-        return GoogleTranslator(source='auto', target=target_language).translate(text)
-    except Exception as e:
-        print(f"Error during translation: {e}")
-        return text
+        conn = ClientConnection(websocket, user_id, on_close=self.disconnect, **self.connection_options)
+        conn.start()
+        connections = self.active_connections.setdefault(user_id, set())
+        connections.add(conn)
+        if len(connections) == 1:
+            await self.broker.register(user_id)
+        print(f"User {user_id} connected ({len(connections)} connection(s) on this worker).")
+        return conn
+    async def disconnect(self, conn: ClientConnection):
+        conn.close(conn.close_reason or "disconnected")
+        connections = self.active_connections.get(conn.user_id)
+        if connections is None or conn not in connections:
+            return
+        connections.discard(conn)
+        if conn.close_reason not in ("disconnected", None):
+            self.evicted += 1
+        if not connections:
+            del self.active_connections[conn.user_id]
+            await self.broker.unregister(conn.user_id)
+        print(f"User {conn.user_id} disconnected.")
+    async def send_json(self, user_id: str, data: dict) -> int:
+        """Deliver to every connection of user_id on any worker; returns the number of workers reached."""
+        return await self.broker.publish(user_id, data)
+    async def deliver_local(self, user_id: str, data: dict):
+        for conn in list(self.active_connections.get(user_id, ())):
+            conn.offer(data)
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.broker.refresh()
+            except Exception as e:
+                print(f"Error refreshing broker presence: {e!r}")
+            now = time.monotonic()
+            for connections in list(self.active_connections.values()):
+                for conn in list(connections):
+                    if conn.idle(now):
+                        conn.close(f"no frames for {now - conn.last_seen:.0f}s")
+                    else:
+                        conn.offer({"type": "ping"})
+    def stats(self) -> dict:
+        conns = [c for cs in self.active_connections.values() for c in cs]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(conns),
+            "queued": sum(c.queue.qsize() for c in conns),
+            "dropped": sum(c.dropped for c in conns),
+            "evicted": self.evicted,
+        }
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+        closing = [conn for connections in self.active_connections.values() for conn in connections]
+        for conn in closing:
+            conn.close("server shutting down")
+        for user_id in list(self.active_connections):
+            await self.broker.unregister(user_id)
+        self.active_connections.clear()
+        await asyncio.gather(*(conn.wait_closed() for conn in closing))
+        await self.broker.close()
 
-async def generate_ai_reply(history: str, new_message: str, target_language: str) -> str:
+# CHAT_BROKER_URL=redis://host:6379/0 routes messages between uvicorn workers;
+# without it everything stays in this process. Presence entries outlive a dead
+# worker by at most CHAT_PRESENCE_TTL seconds (keep it above the heartbeat interval).
+CHAT_BROKER_URL = os.getenv("CHAT_BROKER_URL")
+CHAT_HEARTBEAT_INTERVAL = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "20"))
+manager = ConnectionManager(
+    make_broker(CHAT_BROKER_URL, presence_ttl=float(os.getenv("CHAT_PRESENCE_TTL", str(3 * CHAT_HEARTBEAT_INTERVAL)))),
+    heartbeat_interval=CHAT_HEARTBEAT_INTERVAL,
+    max_queue=int(os.getenv("CHAT_SEND_QUEUE", "256")),
+    overflow=os.getenv("CHAT_SEND_OVERFLOW", "disconnect"),
+    send_timeout=float(os.getenv("CHAT_SEND_TIMEOUT", "5")),
+    idle_timeout=float(os.getenv("CHAT_IDLE_TIMEOUT", "60")),
+)
+
+# Blocking dependencies of the chat path, each with its own threads, concurrency cap and timeout
+db_io = BlockingIO("supabase", max_concurrency=int(os.getenv("DB_MAX_CONCURRENCY", "16")), timeout=float(os.getenv("DB_TIMEOUT", "5")))
+translate_io = BlockingIO("translate", max_concurrency=int(os.getenv("TRANSLATE_MAX_CONCURRENCY", "8")), timeout=float(os.getenv("TRANSLATE_TIMEOUT", "4")))
+llm_io = BlockingIO("gemini", max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")), timeout=float(os.getenv("LLM_TIMEOUT", "20")))
+# the translation cache's sqlite file is shared with the other workers and can be locked by them
+translation_cache_io = BlockingIO("translation-cache", max_concurrency=2, timeout=float(os.getenv("TRANSLATION_CACHE_TIMEOUT", "1")))
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "50"))
+# AI suggestions run after delivery; strong references keep the tasks alive until they finish
+background_tasks = set()
+# AI_STREAM_SUGGESTIONS=0 sends each suggestion as one frame once it is complete
+AI_STREAM_SUGGESTIONS = os.getenv("AI_STREAM_SUGGESTIONS", "1") == "1"
+suggestion_tasks: Dict[str, asyncio.Task] = {}  # conversation_id -> suggestion being generated
+suggestions_cancelled = 0
+
+# Repeated phrases are served from memory / the sqlite cache; misses are coalesced and batched.
+# TRANSLATION_BACKEND=stub gives deterministic local translations for tests and load runs.
+translation_service = TranslationService(
+    StubBackend() if os.getenv("TRANSLATION_BACKEND") == "stub" else GoogleBackend(),
+    translate_io.run,
+    max_size=int(os.getenv("TRANSLATION_CACHE_SIZE", "10000")),
+    db_path=os.getenv("TRANSLATION_CACHE_PATH", "translations.sqlite3") or None,
+    max_wait_ms=float(os.getenv("TRANSLATION_MAX_WAIT_MS", "5")),
+    disk_run=translation_cache_io.run,
+)
+
+def build_prompt(history: str, new_message: str, target_language: str) -> str:
     lang_map = {'hi': 'Hindi', 'en': 'English'}
     language_name = lang_map.get(target_language, 'the user\'s native language')
-    prompt = (f"You are a helpful assistant for an Indian artisan. Based on the conversation history:\n\n---\n{history}\n---\n\nThe buyer just said: '{new_message}'. Generate a polite reply in {language_name}.")
+    return (f"You are a helpful assistant for an Indian artisan. Based on the conversation history:\n\n---\n{history}\n---\n\nThe buyer just said: '{new_message}'. Generate a polite reply in {language_name}.")
+
+async def generate_ai_reply(history: str, new_message: str, target_language: str) -> str:
+    prompt = build_prompt(history, new_message, target_language)
     try:
-        response = gemini_model.generate_content(prompt)
+        response = await llm_io.run(gemini_model.generate_content, prompt)
         return response.text
     except Exception as e:
-        print(f"Error generating AI reply: {e}")
+        print(f"Error generating AI reply: {e!r}")
         return "Could not generate a reply."
 
-def get_conversation_and_participants(conversation_id: str, sender_id: str):
+async def stream_ai_reply(history: str, new_message: str, target_language: str):
+    """Yields the reply in chunks as the model generates it."""
+    prompt = build_prompt(history, new_message, target_language)
+    async for chunk in llm_io.stream(gemini_model.generate_content, prompt, stream=True):
+        try:
+            text = chunk.text
+        except ValueError:  # chunk without text parts (e.g. blocked by a safety filter)
+            continue
+        if text:
+            yield text
+
+def fetch_conversation(conversation_id: str):
+    # participants and only the newest CHAT_HISTORY_WINDOW messages
     try:
-        query = supabase.table("conversations").select("*, messages(*, sender:profiles(*)), participants:profiles(*)").eq("id", conversation_id).single().execute()
+        query = (supabase.table("conversations")
+                 .select("id, messages(*, sender:profiles(*)), participants:profiles(*)")
+                 .eq("id", conversation_id)
+                 .order("created_at", desc=True, foreign_table="messages")
+                 .limit(CHAT_HISTORY_WINDOW, foreign_table="messages")
+                 .single().execute())
         d = query.data
-        if not d: return None, None, None, None
-        s = next((p for p in d['participants'] if p['id'] == sender_id), None)
-        r = next((p for p in d['participants'] if p['id'] != sender_id), None)
-        return d, s, r, d['messages']
+        if not d: return None
+        return d['participants'], d['messages']
     except Exception as e:
         print(f"Error fetching conversation: {e}")
-        return None, None, None, None
+        return None
+
+def fetch_messages_since(conversation_id: str, since: Optional[int]):
+    # seq is assigned on insert, not commit: the cache passes a since that lags its reads by
+    # CHAT_DELTA_OVERLAP seconds, so a row committed out of seq order is still returned
+    query = supabase.table("messages").select("*, sender:profiles(*)").eq("conversation_id", conversation_id)
+    if since is not None:
+        query = query.gt("seq", since)
+    return query.order("seq").execute().data or []
+
+def insert_messages(rows: List[dict]):
+    # ids are assigned by the writer, so a retried batch skips rows that already made it
+    supabase.table("messages").upsert(rows, on_conflict="id", ignore_duplicates=True, returning="minimal").execute()
+
+# Messages are accepted immediately and written behind the delivery path as multi-row inserts;
+# a database outage is retried until it ends, and what is unsaved at shutdown is replayed on the next start
+message_writer = MessageWriter(
+    insert_messages, db_io.run,
+    max_batch=int(os.getenv("CHAT_WRITE_BATCH", "100")),
+    max_wait_ms=float(os.getenv("CHAT_WRITE_MAX_WAIT_MS", "50")),
+    max_queue=int(os.getenv("CHAT_WRITE_QUEUE", "10000")),
+    spill_dir=os.getenv("CHAT_WRITE_SPILL_DIR", "unsaved_messages"),
+)
+
+# Participants and recent history per conversation, loaded once and then kept
+# current with "messages since" queries (which also pick up other workers' writes)
+conversation_cache = ConversationCache(
+    fetch_conversation, fetch_messages_since, db_io.run,
+    max_conversations=int(os.getenv("CHAT_CACHE_CONVERSATIONS", "1000")),
+    history_window=CHAT_HISTORY_WINDOW,
+    idle_ttl=float(os.getenv("CHAT_CACHE_IDLE_TTL", "900")),
+    participants_ttl=float(os.getenv("CHAT_CACHE_PARTICIPANTS_TTL", "300")),
+    pending_fn=message_writer.pending,
+    delta_overlap=float(os.getenv("CHAT_DELTA_OVERLAP", "5")),
+)
+
+def history_turns(messages, sender, saved: dict):
+    """(created_at, "Buyer: ...") per cached message, oldest first, ending with the message just saved."""
+    # the new message is normally already in the cached history; it goes last either way
+    ordered = [m for m in messages if m.get('id') != saved['id']] + [{**saved, 'sender': sender}]
+    def is_buyer(m):
+        # rows without the joined profile: it is either the sender or the other participant
+        if m.get('sender'):
+            return m['sender']['role'] == 'buyer'
+        return (sender['role'] == 'buyer') == (m.get('sender_id') == sender['id'])
+    return [(m['created_at'], f"{'Buyer' if is_buyer(m) else 'Artisan'}: {m['original_text']}") for m in ordered]
 
-def save_message_to_db(conversation_id: str, sender_id: str, text: str):
+def summarize_history(previous_summary: str, lines: List[str]) -> str:
+    prompt = (f"Summarize this negotiation between a buyer and an Indian artisan in at most {AI_SUMMARY_TOKENS * 3 // 4} words. "
+              f"Keep products, prices, quantities, agreed terms and open questions.\n\n"
+              f"Summary so far: {previous_summary or '(none)'}\n\nNew messages:\n" + "\n".join(lines))
+    return gemini_model.generate_content(prompt).text
+
+# Prompt history: recent turns verbatim, older ones folded into a rolling per-conversation summary
+AI_HISTORY_TOKENS = int(os.getenv("AI_HISTORY_TOKENS", "600"))
+AI_SUMMARY_TOKENS = int(os.getenv("AI_SUMMARY_TOKENS", "150"))
+history_compactor = HistoryCompactor(
+    lambda previous, lines: llm_io.run(summarize_history, previous, lines),
+    token_budget=AI_HISTORY_TOKENS, summary_tokens=AI_SUMMARY_TOKENS,
+    max_conversations=int(os.getenv("CHAT_CACHE_CONVERSATIONS", "1000")),
+)
+
+async def send_ai_suggestion(conversation_id: str, recipient: dict, turns: list, translated: str):
+    history = await history_compactor.build(conversation_id, turns)
+    if not AI_STREAM_SUGGESTIONS:
+        ai_reply = await generate_ai_reply(history, translated, recipient['language_preference'])
+        suggestion = AiSuggestion(conversation_id=conversation_id, text=ai_reply)
+        await manager.send_json(recipient['id'], suggestion.dict())
+        return
+    suggestion_id = uuid.uuid4().hex
+    chunks = []
     try:
-        supabase.table("messages").insert({"conversation_id": conversation_id, "sender_id": sender_id, "original_text": text}).execute()
+        async for chunk in stream_ai_reply(history, translated, recipient['language_preference']):
+            chunks.append(chunk)
+            delta = AiSuggestion(type="suggestion_delta", conversation_id=conversation_id, text=chunk, suggestion_id=suggestion_id)
+            await manager.send_json(recipient['id'], delta.dict())
+    except asyncio.CancelledError:
+        cancelled = AiSuggestion(type="suggestion_cancelled", conversation_id=conversation_id, text="", suggestion_id=suggestion_id)
+        await asyncio.shield(manager.send_json(recipient['id'], cancelled.dict()))
+        raise
     except Exception as e:
-        print(f"Error saving message: {e}")
+        print(f"Error streaming AI reply: {e!r}")
+        chunks = ["Could not generate a reply."]
+    suggestion = AiSuggestion(conversation_id=conversation_id, text="".join(chunks), suggestion_id=suggestion_id)
+    await manager.send_json(recipient['id'], suggestion.dict())
+
+def start_ai_suggestion(conversation_id: str, recipient: dict, turns: list, translated: str):
+    # one suggestion per conversation: a newer message replaces the one still generating
+    cancel_ai_suggestion(conversation_id)
+    task = asyncio.create_task(send_ai_suggestion(conversation_id, recipient, turns, translated))
+    suggestion_tasks[conversation_id] = task
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    task.add_done_callback(lambda t: suggestion_tasks.pop(conversation_id, None) if suggestion_tasks.get(conversation_id) is t else None)
+
+def cancel_ai_suggestion(conversation_id: str):
+    global suggestions_cancelled
+    task = suggestion_tasks.pop(conversation_id, None)
+    if task is not None and not task.done():
+        task.cancel()
+        suggestions_cancelled += 1
+
+async def handle_incoming(user_id: str, incoming: IncomingMessage):
+    try:
+        state = await conversation_cache.get(incoming.conversation_id)
+    except Exception as e:
+        print(f"Error loading conversation {incoming.conversation_id}: {e!r}")
+        state = None
+    sender = state and state.participant(user_id)
+    recipient = state and state.participant(user_id, is_self=False)
+    if not (sender and recipient):
+        await manager.send_json(user_id, {"error": "Invalid conversation or user."})
+        return
+    # the suggestion being generated answers a message that is no longer the latest
+    cancel_ai_suggestion(incoming.conversation_id)
+    # queued, not written yet; the cache makes it visible to this worker's history right away
+    saved = await message_writer.submit(incoming.conversation_id, user_id, incoming.text)
+    conversation_cache.add_message(incoming.conversation_id, {**saved, 'sender': sender})
+    try:
+        translated = await translation_service.translate(incoming.text, recipient['language_preference'])
+    except Exception as e:
+        print(f"Translation failed for conversation {incoming.conversation_id} ({e!r}); delivering original text")
+        translated = incoming.text
+    outgoing_msg = OutgoingMessage(conversation_id=incoming.conversation_id, sender_id=user_id, text=translated)
+    await manager.send_json(recipient['id'], outgoing_msg.dict())
+    if recipient['role'] == 'artisan':
+        turns = history_turns(state.messages, sender, saved)
+        start_ai_suggestion(incoming.conversation_id, recipient, turns, translated)
 
 @app.websocket("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(user_id, websocket)
+    conn = await manager.connect(user_id, websocket)
     try:
         while True:
             data = await websocket.receive_json()
-            incoming = IncomingMessage(**data)
-            save_message_to_db(incoming.conversation_id, user_id, incoming.text)
-            _, sender, recipient, messages = get_conversation_and_participants(incoming.conversation_id, user_id)
-            if not (sender and recipient):
-                if manager.active_connections.get(user_id):
-                    await manager.send_json(user_id, {"error": "Invalid conversation or user."})
+            conn.touch(pong=data.get("type") == "pong")
+            if data.get("type") == "pong":
                 continue
-            translated = translate_text(incoming.text, recipient['language_preference'])
-            outgoing_msg = OutgoingMessage(conversation_id=incoming.conversation_id, sender_id=user_id, text=translated)
-            if manager.active_connections.get(recipient['id']):
-                 await manager.send_json(recipient['id'], outgoing_msg.dict())
-            if recipient['role'] == 'artisan':
-                history = "\n".join([f"{'Buyer' if m['sender']['role'] == 'buyer' else 'Artisan'}: {m['original_text']}" for m in sorted(messages, key=lambda m: m.get('created_at', ''))])
-                history += f"\n{'Buyer' if sender['role'] == 'buyer' else 'Artisan'}: {incoming.text}"
-                ai_reply = await generate_ai_reply(history, translated, recipient['language_preference'])
-                suggestion = AiSuggestion(conversation_id=incoming.conversation_id, text=ai_reply)
-                if manager.active_connections.get(recipient['id']):
-                    await manager.send_json(recipient['id'], suggestion.dict())
+            incoming = IncomingMessage(**data)
+            await handle_incoming(user_id, incoming)
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        await manager.disconnect(conn)
     except Exception as e:
         print(f"An error occurred with user {user_id}: {e}")
-        manager.disconnect(user_id)
+        await manager.disconnect(conn)
+
+@app.get("/ws/connections")
+async def websocket_connections():
+    """Per-connection send queue depth and send latency, busiest first."""
+    conns = [c.stats() for cs in manager.active_connections.values() for c in cs]
+    return sorted(conns, key=lambda c: c["queued"], reverse=True)
+
+@app.get("/ws/stats")
+async def websocket_stats():
+    return {
+        **manager.stats(),
+        "broker": manager.broker.stats(),
+        "background_tasks": len(background_tasks),
+        "suggestions": {"streaming": AI_STREAM_SUGGESTIONS, "in_flight": len(suggestion_tasks),
+                        "cancelled": suggestions_cancelled},
+        "io": {pool.name: pool.stats() for pool in (db_io, translate_io, llm_io, translation_cache_io)},
+        "conversation_cache": conversation_cache.stats(),
+        "translation": translation_service.stats(),
+        "message_writer": message_writer.stats(),
+        "history": history_compactor.stats(),
+    }
+
+@app.on_event("startup")
+async def start_chat_io():
+    message_writer.start()
+    await manager.start()
+
+@app.on_event("shutdown")
+async def stop_chat_io():
+    for task in list(background_tasks):
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await translation_service.close()
+    await manager.close()
+    # flush queued messages before the database threads go away
+    await message_writer.close()
+    for pool in (db_io, translate_io, llm_io, translation_cache_io):
+        pool.shutdown()
 
 
 # --- 5. API Endpoint for AI Listing Generator ---
@@ -191,3 +491,138 @@ async def generate_listing(image: UploadFile = File(...)):
         print(f"Error during AI listing generation: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate AI content.")
         raise HTTPException(status_code=500, detail=f"Failed to generate content: {e}")
+
+
+# --- 6. Price Prediction Endpoint (warm model, micro-batched, hot-reloadable) ---
+PRICE_ARTIFACT_PATH = os.getenv("PRICE_ARTIFACT_PATH", "price_model_artifact")
+PRICE_MODEL_PATH = os.getenv("PRICE_MODEL_PATH", "price_model.pkl")
+PRICE_PREPROC_PATH = os.getenv("PRICE_PREPROC_PATH", "preprocessor.pkl")
+PRICE_MAX_BATCH_SIZE = int(os.getenv("PRICE_MAX_BATCH_SIZE", "32"))
+PRICE_MAX_WAIT_MS = float(os.getenv("PRICE_MAX_WAIT_MS", "5"))
+PRICE_CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "10000"))
+PRICE_CACHE_TTL = float(os.getenv("PRICE_CACHE_TTL", "0")) or None
+# JSON list of product rows a new model version must price before it is swapped in
+PRICE_SMOKE_PATH = os.getenv("PRICE_SMOKE_PATH")
+# optional per-segment models: column name + JSON {"<value>": "<artifact dir or model.pkl>"}
+PRICE_SEGMENT_COL = os.getenv("PRICE_SEGMENT_COL")
+PRICE_SEGMENT_MODELS = json.loads(os.getenv("PRICE_SEGMENT_MODELS", "{}"))
+# /predict-price/reload and /rollback require "Authorization: Bearer <PRICE_ADMIN_TOKEN>" (disabled when unset)
+# and only load artifact directories that sit directly inside PRICE_MODEL_DIR, named by the request
+PRICE_ADMIN_TOKEN = os.getenv("PRICE_ADMIN_TOKEN")
+PRICE_MODEL_DIR = os.getenv("PRICE_MODEL_DIR", "models")
+MODEL_VERSION_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,127}")
+
+price_registry: Optional[ModelRegistry] = None
+price_batcher: Optional[PriceBatcher] = None
+# repeated listings skip the batcher; entries are dropped whenever a model version changes
+price_cache = PredictionCache(max_size=PRICE_CACHE_SIZE, ttl=PRICE_CACHE_TTL)
+
+@app.on_event("startup")
+async def load_price_model():
+    global price_registry, price_batcher
+    smoke_rows = None
+    if PRICE_SMOKE_PATH:
+        with open(PRICE_SMOKE_PATH) as f:
+            smoke_rows = json.load(f)
+    registry = ModelRegistry(smoke_rows=smoke_rows, segment_col=PRICE_SEGMENT_COL)
+    for segment, path in PRICE_SEGMENT_MODELS.items():
+        registry.register_segment(segment, path)
+    source = PRICE_ARTIFACT_PATH if os.path.isdir(PRICE_ARTIFACT_PATH) else PRICE_MODEL_PATH
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, registry.load, source, PRICE_PREPROC_PATH)
+    except Exception as e:
+        print(f"Price model not loaded, /predict-price disabled: {e}")
+        registry.close()
+        return
+    price_registry = registry
+    price_batcher = PriceBatcher(registry=registry, max_batch_size=PRICE_MAX_BATCH_SIZE, max_wait_ms=PRICE_MAX_WAIT_MS)
+    await price_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_price_batcher():
+    if price_batcher:
+        await price_batcher.stop()
+    if price_registry:
+        price_registry.close()
+
+@app.post("/predict-price", response_model=PriceResponse)
+async def predict_price(request: PriceRequest):
+    if price_batcher is None:
+        raise HTTPException(status_code=503, detail="Price model is not loaded.")
+    row = normalize_row(request.dict(), CAT_COLS)
+    key = prediction_key(row)
+    cached = price_cache.get(key, price_registry.generation)
+    if cached is None:
+        price, info = await price_batcher.predict(row)
+        generation = info.pop("generation")
+        cached = (price, info)
+        # a result served before a swap that happened during the await is not cached (and does
+        # not evict the new generation's entries)
+        if generation == price_registry.generation:
+            price_cache.put(key, generation, cached)
+    price, info = cached
+    if price is None:
+        raise HTTPException(status_code=422, detail={"error": "No similar product found in training dataset.", **info})
+    return PriceResponse(predicted_price=price, max_cat_matches=info["max_cat_matches"], max_text_similarity=info["max_text_similarity"])
+
+@app.get("/predict-price/stats")
+async def predict_price_stats():
+    if price_batcher is None:
+        raise HTTPException(status_code=503, detail="Price model is not loaded.")
+    return {**price_batcher.stats(), "cache": price_cache.stats()}
+
+def require_price_admin(authorization: Optional[str] = Header(None)):
+    if not PRICE_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled.")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), PRICE_ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token.", headers={"WWW-Authenticate": "Bearer"})
+
+def resolve_model_version(name: str) -> str:
+    """Artifact directory for a version name; anything outside PRICE_MODEL_DIR is rejected."""
+    if not MODEL_VERSION_NAME.fullmatch(name):
+        raise HTTPException(status_code=400, detail="Invalid model version name.")
+    root = os.path.realpath(PRICE_MODEL_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.dirname(path) != root or not os.path.isfile(os.path.join(path, "manifest.json")):
+        raise HTTPException(status_code=404, detail=f"Unknown model version {name!r}.")
+    return path
+
+def resolve_segment(segment: Optional[str]) -> Optional[str]:
+    if not segment:
+        return None
+    segment = segment.strip().lower()
+    if segment not in price_registry.segments():
+        raise HTTPException(status_code=404, detail=f"Unknown segment {segment!r}.")
+    return segment
+
+@app.post("/predict-price/reload", status_code=202, dependencies=[Depends(require_price_admin)])
+async def reload_price_model(request: ModelReloadRequest):
+    """Load a new model version in the background; it is swapped in only if it passes the smoke check."""
+    if price_registry is None:
+        raise HTTPException(status_code=503, detail="Price model is not loaded.")
+    path = resolve_model_version(request.version)
+    segment = resolve_segment(request.segment)
+    future = price_registry.load_async(path, None, segment)
+
+    def report(f):
+        if f.exception() is not None:
+            print(f"Model reload of version {request.version} rejected: {f.exception()}")
+    future.add_done_callback(report)
+    return {"status": "loading", "version": request.version, "segment": segment}
+
+@app.post("/predict-price/rollback", dependencies=[Depends(require_price_admin)])
+async def rollback_price_model(segment: Optional[str] = None):
+    if price_registry is None:
+        raise HTTPException(status_code=503, detail="Price model is not loaded.")
+    try:
+        version = price_registry.rollback(resolve_segment(segment))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"status": "rolled back", "version": version}
+
+@app.get("/predict-price/models")
+async def price_models():
+    if price_registry is None:
+        raise HTTPException(status_code=503, detail="Price model is not loaded.")
+    return price_registry.stats()
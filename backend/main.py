@@ -94,35 +94,69 @@
 
 
 # main.py
-from services.data_utils import load_dataset
+import services.config as cfg
+from services.data_utils import load_dataset, dataset_hash
 from services.preprocessing import fit_preprocessor
 from services.model_utils import train_model
 from services.predictor import predict_with_similarity_check
-from services.model_utils import train_model, save_model_and_preproc
-from services.config import DATA_PATH
-
-def run_pipeline():
-    # Load dataset
-    df = load_dataset(DATA_PATH)
-
-    # Ensure 'price' column exists
-    if 'price' not in df.columns:
-        raise ValueError("Dataset is missing required column: 'price'")
+from services.model_utils import train_model, save_model_and_preproc, MODEL_PARAMS, DATASET_PARAMS
+from services.artifact import save_artifact
+from services.pipeline_cache import cached_stage, stage_key, code_version
+from services.config import DATA_PATH, PIPELINE_CACHE_DIR
+
+# config values fit_preprocessor output depends on
+PREPROC_CONFIG = [
+    'TFIDF_MAX_FEATURES', 'TFIDF_NGRAM', 'SVD_COMPONENTS', 'CARDINALITY_MIN_FREQ', 'RANDOM_STATE',
+    'FEATURE_DTYPE', 'SIMILARITY_INDEX_MODE', 'SIMILARITY_N_PROBE', 'SIMILARITY_PRECISION',
+]
+
+def run_pipeline(cache_dir=PIPELINE_CACHE_DIR):
+    # Each stage is cached by content (dataset hash, config, code version),
+    # so a rerun with nothing changed skips fitting and training, and a
+    # model-only change reuses the fitted preprocessor. cache_dir=None
+    # always recomputes.
+    data_key = dataset_hash(DATA_PATH)
+    df = None
+
+    def dataset():
+        # only loaded when a stage actually has to run
+        nonlocal df
+        if df is None:
+            df = load_dataset(DATA_PATH)
+            # Ensure 'price' column exists
+            if 'price' not in df.columns:
+                raise ValueError("Dataset is missing required column: 'price'")
+        return df
 
     # Preprocessing
-    preproc = fit_preprocessor(df)
+    preproc_key = stage_key(
+        data=data_key,
+        config={name: getattr(cfg, name) for name in PREPROC_CONFIG},
+        code=code_version('preprocessing', 'category_encoder', 'text_embedder', 'similarity_index'),
+    )
+    preproc, _ = cached_stage('preprocess', preproc_key, lambda: fit_preprocessor(dataset()), cache_dir)
     X_full = preproc['X_full_df']
-    y = df['price'].astype(float)
 
     # Safely get categorical columns
     cat_cols = preproc.get('cat_cols', None)
     print("Categorical columns:", cat_cols)
 
     # Train model
-    model, metrics = train_model(X_full, y, cat_cols)
+    train_key = stage_key(
+        preproc=preproc_key,
+        params={'model': MODEL_PARAMS, 'dataset': DATASET_PARAMS},
+        config={name: getattr(cfg, name) for name in ('RANDOM_STATE', 'GATE_EVAL_ROWS')},
+        code=code_version('model_utils', 'similarity'),
+    )
+    (model, metrics), _ = cached_stage(
+        'train', train_key,
+        lambda: train_model(X_full, dataset()['price'].astype(float), cat_cols, preproc=preproc),
+        cache_dir,
+    )
     print("Validation metrics:", metrics)
     
     save_model_and_preproc(model, preproc)
+    save_artifact(model, preproc)
 
     return model, preproc
 
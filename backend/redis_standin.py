@@ -0,0 +1,148 @@
+"""
+Minimal Redis stand-in for local multi-worker runs without a Redis server.
+
+Speaks enough RESP2/RESP3 for services/broker.RedisBroker: HELLO, PING,
+SELECT, CLIENT, SADD/SREM/SMEMBERS/DEL/EXPIRE and PUBLISH/SUBSCRIBE/UNSUBSCRIBE.
+Data lives in memory and is lost on exit. Not for production use.
+
+    python redis_standin.py --port 6390
+    CHAT_BROKER_URL=redis://127.0.0.1:6390/0 uvicorn app:app --workers 4
+"""
+import argparse
+import asyncio
+import time
+
+
+def encode(value, push: bool = False) -> bytes:
+    # push=True marks pub/sub frames as RESP3 pushes (">") instead of arrays
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+" + value.encode() + b"\r\n"
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, Exception):
+        return b"-ERR " + str(value).encode() + b"\r\n"
+    if isinstance(value, dict):
+        return b"%%%d\r\n" % len(value) + b"".join(encode(k) + encode(v) for k, v in value.items())
+    return (b">" if push else b"*") + b"%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+
+
+async def read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):  # inline command
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+class RedisStandIn:
+    def __init__(self):
+        self.sets = {}
+        self.expires = {}   # key -> monotonic deadline
+        self.channels = {}  # channel -> set of writers
+        self.resp3 = set()  # writers that switched protocol with HELLO 3
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                name, args = args[0].upper(), args[1:]
+                push = writer in self.resp3
+                if name == b"HELLO":
+                    if args and int(args[0]) == 3:
+                        self.resp3.add(writer)
+                    writer.write(encode({b"server": b"redis", b"version": b"7.0.0",
+                                         b"proto": 3 if writer in self.resp3 else 2}))
+                elif name == b"SUBSCRIBE":
+                    for channel in args:
+                        self.channels.setdefault(channel, set()).add(writer)
+                        subscribed.add(channel)
+                        writer.write(encode([b"subscribe", channel, len(subscribed)], push))
+                elif name == b"UNSUBSCRIBE":
+                    for channel in args or list(subscribed):
+                        self.channels.get(channel, set()).discard(writer)
+                        subscribed.discard(channel)
+                        writer.write(encode([b"unsubscribe", channel, len(subscribed)], push))
+                elif name == b"QUIT":
+                    writer.write(encode("OK"))
+                    break
+                else:
+                    writer.write(encode(self.execute(name, args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.channels.get(channel, set()).discard(writer)
+            self.resp3.discard(writer)
+            writer.close()
+
+    def _expire_due(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and time.monotonic() >= deadline:
+            self.sets.pop(key, None)
+            self.expires.pop(key, None)
+
+    def execute(self, name, args):
+        if args and name in (b"SADD", b"SREM", b"SMEMBERS", b"EXPIRE"):
+            self._expire_due(args[0])
+        if name == b"PING":
+            return args[0] if args else "PONG"
+        if name in (b"SELECT", b"CLIENT", b"RESET"):
+            return "OK"
+        if name == b"SADD":
+            members = self.sets.setdefault(args[0], set())
+            before = len(members)
+            members.update(args[1:])
+            return len(members) - before
+        if name == b"SREM":
+            members = self.sets.get(args[0], set())
+            removed = len(members & set(args[1:]))
+            members.difference_update(args[1:])
+            if not members:
+                self.sets.pop(args[0], None)
+                self.expires.pop(args[0], None)
+            return removed
+        if name == b"SMEMBERS":
+            return sorted(self.sets.get(args[0], ()))
+        if name == b"EXPIRE":
+            if args[0] not in self.sets:
+                return 0
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return 1
+        if name == b"DEL":
+            for k in args:
+                self.expires.pop(k, None)
+            return sum(self.sets.pop(k, None) is not None for k in args)
+        if name == b"PUBLISH":
+            subscribers = list(self.channels.get(args[0], ()))
+            for w in subscribers:
+                w.write(encode([b"message", args[0], args[1]], w in self.resp3))
+            return len(subscribers)
+        return ValueError(f"unknown command '{name.decode()}'")
+
+
+async def serve(host: str, port: int):
+    server = await asyncio.start_server(RedisStandIn().handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    print(f"✅ Redis stand-in listening on {args.host}:{args.port}")
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+
+
+class BlockingIO:
+    """
+    Runs blocking calls to one external dependency (database, translator, LLM)
+    off the event loop.
+    Each dependency gets its own thread pool of max_concurrency workers, so a
+    slow or hung dependency can only tie up its own threads, never the loop or
+    the other dependencies. Every call is bounded by timeout seconds;
+    asyncio.TimeoutError is raised to the caller (the thread finishes in the
+    background and its result is dropped).
+    """
+
+    def __init__(self, name: str, max_concurrency: int = 8, timeout: float = 10.0, window: int = 2000):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f"io-{name}")
+        self._latencies_ms = deque(maxlen=window)
+        self.in_flight = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    async def run(self, fn, *args, timeout: float = None, **kwargs):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        self.calls += 1
+        self.in_flight += 1
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, partial(fn, *args, **kwargs)),
+                timeout if timeout is not None else self.timeout,
+            )
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    async def stream(self, fn, *args, timeout: float = None, **kwargs):
+        """
+        Async iterator over the items of the blocking iterable fn(*args, **kwargs),
+        which is created and consumed on one of this dependency's threads.
+        timeout bounds the wait for each item. If the consumer stops early
+        (break, cancellation), the thread stops pulling items after the current one.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                items = fn(*args, **kwargs)
+                for item in items:
+                    if stop.is_set():
+                        getattr(items, "close", lambda: None)()
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, e))
+            else:
+                loop.call_soon_threadsafe(queue.put_nowait, (done, None))
+
+        start = time.perf_counter()
+        self.calls += 1
+        self.in_flight += 1
+        producer = loop.run_in_executor(self._executor, produce)
+        try:
+            while True:
+                try:
+                    item, error = await asyncio.wait_for(queue.get(), timeout if timeout is not None else self.timeout)
+                except asyncio.TimeoutError:
+                    self.timeouts += 1
+                    raise
+                if error is not None:
+                    self.errors += 1
+                    raise error
+                if item is done:
+                    break
+                yield item
+        finally:
+            stop.set()
+            producer.add_done_callback(lambda f: f.exception())
+            self.in_flight -= 1
+            self._latencies_ms.append((time.perf_counter() - start) * 1000)
+
+    def stats(self) -> dict:
+        lat = np.asarray(self._latencies_ms) if self._latencies_ms else np.zeros(1)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "timeout_s": self.timeout,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p99_ms": float(np.percentile(lat, 99)),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,229 @@
+import asyncio
+import json
+import uuid
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # only needed for CHAT_BROKER_URL=redis://...
+    aioredis = None
+
+
+class InMemoryBroker:
+    """
+    Routes chat frames between workers that share one process (a single
+    uvicorn worker, or several ConnectionManagers in a test).
+    Brokers created with the same `hub` dict see each other's presence.
+
+    Broker interface used by ConnectionManager:
+      start(deliver)      deliver(user_id, data) sends to this worker's sockets
+      register(user_id)   this worker now holds a connection of user_id
+      unregister(user_id) ... and no longer does
+      locate(user_id)     ids of the workers holding the user's connections
+      publish(user_id, data) -> number of workers it was delivered to
+      refresh()           periodic keep-alive of this worker's presence
+      stats(), close()
+    """
+
+    def __init__(self, hub: dict = None, worker_id: str = None):
+        self.hub = hub if hub is not None else {"workers": {}, "presence": {}}
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self.published = 0
+        self.remote_deliveries = 0
+
+    async def start(self, deliver):
+        self.hub["workers"][self.worker_id] = deliver
+
+    async def register(self, user_id: str):
+        self.hub["presence"].setdefault(user_id, set()).add(self.worker_id)
+
+    async def unregister(self, user_id: str):
+        workers = self.hub["presence"].get(user_id)
+        if workers is not None:
+            workers.discard(self.worker_id)
+            if not workers:
+                del self.hub["presence"][user_id]
+
+    async def locate(self, user_id: str) -> set:
+        return set(self.hub["presence"].get(user_id, ()))
+
+    async def refresh(self):
+        pass
+
+    async def publish(self, user_id: str, data: dict) -> int:
+        self.published += 1
+        delivered = 0
+        for worker_id in await self.locate(user_id):
+            deliver = self.hub["workers"].get(worker_id)
+            if deliver is None:
+                continue
+            if worker_id != self.worker_id:
+                self.remote_deliveries += 1
+            await deliver(user_id, data)
+            delivered += 1
+        return delivered
+
+    def stats(self) -> dict:
+        return {"type": "memory", "worker_id": self.worker_id, "published": self.published,
+                "remote_deliveries": self.remote_deliveries, "online_users": len(self.hub["presence"])}
+
+    async def close(self):
+        self.hub["workers"].pop(self.worker_id, None)
+        for user_id in [u for u, w in self.hub["presence"].items() if self.worker_id in w]:
+            await self.unregister(user_id)
+
+
+class RedisBroker:
+    """
+    Routes chat frames between worker processes through Redis.
+    Presence is a set per user (chat:presence:<user_id>) of the workers
+    holding one of its connections. A frame for a user is sent straight to
+    this worker's own sockets and PUBLISHed to the channel of every other
+    worker in the set (chat:worker:<worker_id>). A worker that died without
+    cleaning up has no subscriber on its channel, so PUBLISH returns 0 and it
+    is removed from the set. Presence keys expire after presence_ttl seconds
+    unless refresh() (called from the heartbeat) renews them.
+    If the subscription fails, the listener reconnects with exponential
+    backoff, resubscribes and registers this worker's users again.
+    """
+
+    def __init__(self, url: str, worker_id: str = None, prefix: str = "chat", presence_ttl: float = 60.0,
+                 reconnect_backoff: float = 0.5, max_reconnect_backoff: float = 10.0):
+        if aioredis is None:
+            raise RuntimeError("CHAT_BROKER_URL needs the redis package: pip install redis")
+        self.url = url
+        self.worker_id = worker_id or uuid.uuid4().hex[:12]
+        self.prefix = prefix
+        self.presence_ttl = presence_ttl
+        self.reconnect_backoff = reconnect_backoff
+        self.max_reconnect_backoff = max_reconnect_backoff
+        # one retry on a fresh connection, so the first command after a Redis restart does not fail
+        self.redis = aioredis.from_url(url, retry_on_error=[aioredis.ConnectionError, aioredis.TimeoutError])
+        self._pubsub = None
+        self._listener = None
+        self._deliver = None
+        self._local_users = set()  # users registered by this worker
+        self.published = 0
+        self.remote_deliveries = 0
+        self.received = 0
+        self.malformed = 0
+        self.pruned = 0
+        self.reconnects = 0
+
+    def _channel(self, worker_id: str) -> str:
+        return f"{self.prefix}:worker:{worker_id}"
+
+    def _presence(self, user_id: str) -> str:
+        return f"{self.prefix}:presence:{user_id}"
+
+    async def start(self, deliver):
+        self._deliver = deliver
+        await self._subscribe()
+        self._listener = asyncio.create_task(self._listen())
+
+    async def _subscribe(self):
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self._channel(self.worker_id))
+
+    async def _listen(self):
+        delay = self.reconnect_backoff
+        while True:
+            try:
+                if self._pubsub is None:
+                    await self._subscribe()
+                    # other workers may have pruned us while we could not receive
+                    await self.refresh()
+                    self.reconnects += 1
+                    print(f"✅ Broker worker {self.worker_id} resubscribed")
+                delay = self.reconnect_backoff
+                async for message in self._pubsub.listen():
+                    if message.get("type") == "message":
+                        await self._handle(message["data"])
+                raise ConnectionError("subscription ended")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Broker subscription of worker {self.worker_id} lost ({e!r}), reconnecting in {delay:.1f}s")
+                pubsub, self._pubsub = self._pubsub, None
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_backoff)
+
+    async def _handle(self, payload):
+        try:
+            frame = json.loads(payload)
+            user_id, data = frame["user_id"], frame["data"]
+        except (ValueError, TypeError, KeyError) as e:
+            self.malformed += 1
+            print(f"Dropping malformed routed message: {e!r}")
+            return
+        self.received += 1
+        try:
+            await self._deliver(user_id, data)
+        except Exception as e:
+            print(f"Error delivering routed message to {user_id}: {e!r}")
+
+    async def _add_presence(self, user_ids):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.sadd(self._presence(user_id), self.worker_id)
+                pipe.expire(self._presence(user_id), max(1, int(self.presence_ttl)))
+            await pipe.execute()
+
+    async def register(self, user_id: str):
+        self._local_users.add(user_id)
+        await self._add_presence([user_id])
+
+    async def unregister(self, user_id: str):
+        self._local_users.discard(user_id)
+        await self.redis.srem(self._presence(user_id), self.worker_id)
+
+    async def refresh(self):
+        """Re-add this worker to the presence set of every local user and renew the TTLs."""
+        if self._local_users:
+            await self._add_presence(list(self._local_users))
+
+    async def locate(self, user_id: str) -> set:
+        return {w.decode() if isinstance(w, bytes) else w for w in await self.redis.smembers(self._presence(user_id))}
+
+    async def publish(self, user_id: str, data: dict) -> int:
+        self.published += 1
+        delivered = 0
+        payload = None
+        for worker_id in await self.locate(user_id):
+            if worker_id == self.worker_id:
+                await self._deliver(user_id, data)
+                delivered += 1
+                continue
+            payload = payload or json.dumps({"user_id": user_id, "data": data})
+            if await self.redis.publish(self._channel(worker_id), payload):
+                self.remote_deliveries += 1
+                delivered += 1
+            else:
+                self.pruned += 1
+                await self.redis.srem(self._presence(user_id), worker_id)
+        return delivered
+
+    def stats(self) -> dict:
+        return {"type": "redis", "worker_id": self.worker_id, "published": self.published,
+                "remote_deliveries": self.remote_deliveries, "received": self.received,
+                "malformed": self.malformed, "pruned": self.pruned, "reconnects": self.reconnects,
+                "subscribed": self._pubsub is not None, "local_users": len(self._local_users)}
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        await self.redis.aclose()
+
+
+def make_broker(url: str = None, **options):
+    """InMemoryBroker when url is empty, RedisBroker (with options) for redis:// URLs."""
+    if not url:
+        return InMemoryBroker()
+    return RedisBroker(url, **options)
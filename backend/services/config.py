@@ -11,6 +11,15 @@ elif os.path.exists("data.xls"):
 else:
     DATA_PATH = None   # Will cause error in data_utils if not found
 
+# Columnar cache of the parsed dataset (see data_utils.load_dataset)
+DATA_CACHE_DIR = ".data_cache"
+
+# Binned LightGBM training datasets (see model_utils.train_model)
+DATASET_CACHE_DIR = ".lgb_cache"
+
+# Content-addressed pipeline stage outputs (see main.run_pipeline)
+PIPELINE_CACHE_DIR = ".pipeline_cache"
+
 # Required columns
 REQUIRED_COLS = [
     'product_type', 'material', 'color', 'style',
@@ -21,6 +30,15 @@ REQUIRED_COLS = [
 TFIDF_MAX_FEATURES = 5000
 TFIDF_NGRAM = (1, 2)
 SVD_COMPONENTS = 50
+# dtype of the SVD features (X_svd_array / svd_* columns): 'float32' or 'float64'
+FEATURE_DTYPE = 'float32'
+# batches up to this many rows skip sklearn and use the fused TextEmbedder
+EMBEDDER_MAX_ROWS = 16
+
+# Streaming (out-of-core) fit: hashed n-gram buckets and SVD passes over the data
+HASHING_N_FEATURES = 2 ** 20
+STREAMING_SVD_ITER = 3
+STREAMING_CHUNK_SIZE = 50_000
 
 # Category handling
 CARDINALITY_MIN_FREQ = 2
@@ -29,5 +47,24 @@ CARDINALITY_MIN_FREQ = 2
 SIMILARITY_THRESHOLD = 0.60
 MIN_CATEGORY_MATCHES = 3
 
+# Prediction cache (predictor.PredictionCache): max entries, TTL in seconds (None = no expiry)
+PREDICTION_CACHE_SIZE = 10_000
+PREDICTION_CACHE_TTL = None
+
+# Similarity index: 'exact' or 'ivf' (approximate, bucketed)
+SIMILARITY_INDEX_MODE = 'exact'
+SIMILARITY_N_PROBE = 8   # ivf only: buckets scanned per query, higher = better recall
+# stored similarity vectors: 'float32' or 'int8' (scalar-quantized, per-vector scale)
+SIMILARITY_PRECISION = 'float32'
+# validation rows train_model checks the text gate on (exact float64 vs index)
+GATE_EVAL_ROWS = 2000
+
+# Incremental retraining: refit from scratch when the current model's MAE on
+# new listings is this much (relative) above its own validation MAE
+RETRAIN_DRIFT_THRESHOLD = 0.25
+
+# Cross-validated training (model_utils.train_model_cv)
+CV_FOLDS = 5
+
 # Random seed
 RANDOM_STATE = 42
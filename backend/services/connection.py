@@ -0,0 +1,126 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+OVERFLOW_POLICIES = ("disconnect", "drop_oldest", "drop_new")
+
+
+class ClientConnection:
+    """
+    One websocket with its own bounded outbound queue and writer task, so
+    frames for a slow or half-dead client pile up in its queue instead of
+    blocking whoever sends them.
+    When the queue is full, `overflow` decides: "disconnect" closes the
+    connection (the client reconnects and reloads history), "drop_oldest"
+    discards the oldest queued frame, "drop_new" discards the new one.
+    A send that takes longer than send_timeout closes the connection too.
+    Once the client has answered a ping, it is also closed after idle_timeout
+    seconds without any frame from it (see ConnectionManager.heartbeat).
+    """
+
+    def __init__(self, websocket, user_id: str, max_queue: int = 256, overflow: str = "disconnect",
+                 send_timeout: float = 5.0, idle_timeout: float = 60.0, on_close=None, window: int = 500):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}, got {overflow!r}")
+        self.websocket = websocket
+        self.user_id = user_id
+        self.overflow = overflow
+        self.send_timeout = send_timeout
+        self.idle_timeout = idle_timeout
+        self.on_close = on_close
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.connected_at = self.last_seen = time.monotonic()
+        self.heartbeat_armed = False
+        self.closed = False
+        self.close_reason = None
+        self._writer = None
+        self._closer = None
+        self._send_ms = deque(maxlen=window)
+        self.sent = 0
+        self.dropped = 0
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_forever())
+
+    def offer(self, data: dict) -> bool:
+        """Queue a frame without waiting; returns False if it was not queued."""
+        if self.closed:
+            return False
+        if self.queue.full():
+            if self.overflow == "disconnect":
+                self.close("send queue full")
+                return False
+            self.dropped += 1
+            if self.overflow == "drop_new":
+                return False
+            self.queue.get_nowait()
+        self.queue.put_nowait((time.perf_counter(), data))
+        return True
+
+    async def _write_forever(self):
+        while True:
+            queued_at, data = await self.queue.get()
+            try:
+                await asyncio.wait_for(self.websocket.send_json(data), self.send_timeout)
+            except asyncio.TimeoutError:
+                self.close(f"send took longer than {self.send_timeout}s")
+                return
+            except Exception as e:
+                self.close(f"send failed: {e!r}")
+                return
+            self.sent += 1
+            # time in the queue plus the send itself
+            self._send_ms.append((time.perf_counter() - queued_at) * 1000)
+
+    def touch(self, pong: bool = False):
+        self.last_seen = time.monotonic()
+        if pong:
+            self.heartbeat_armed = True
+
+    def idle(self, now: float) -> bool:
+        return self.heartbeat_armed and now - self.last_seen > self.idle_timeout
+
+    def close(self, reason: str):
+        """Stop the writer and close the socket; safe to call more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        self.close_reason = reason
+        print(f"Closing connection of user {self.user_id}: {reason}")
+        if self._writer is not None and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        self._closer = asyncio.create_task(self._close_socket())
+        self._closer.add_done_callback(self._close_done)
+
+    def _close_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error closing connection of user {self.user_id}: {task.exception()!r}")
+
+    async def wait_closed(self):
+        """Wait until the socket close started by close() (and on_close) has finished."""
+        if self._closer is not None:
+            await asyncio.gather(self._closer, return_exceptions=True)
+
+    async def _close_socket(self):
+        try:
+            await asyncio.wait_for(self.websocket.close(code=1011), self.send_timeout)
+        except Exception:
+            pass
+        if self.on_close is not None:
+            await self.on_close(self)
+
+    def stats(self) -> dict:
+        send_ms = np.asarray(self._send_ms) if self._send_ms else np.zeros(1)
+        return {
+            "user_id": self.user_id,
+            "queued": self.queue.qsize(),
+            "max_queue": self.queue.maxsize,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "send_p50_ms": round(float(np.percentile(send_ms, 50)), 2),
+            "send_p99_ms": round(float(np.percentile(send_ms, 99)), 2),
+            "idle_s": round(time.monotonic() - self.last_seen, 1),
+            "heartbeat": self.heartbeat_armed,
+        }
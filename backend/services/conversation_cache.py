@@ -0,0 +1,198 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+
+class ConversationState:
+    """Participants and the most recent messages (oldest first) of one conversation."""
+
+    def __init__(self, conversation_id: str, participants: list, messages: list, history_window: int,
+                 overlap: float = 5.0):
+        self.conversation_id = conversation_id
+        self.participants = participants
+        self.messages = deque(maxlen=history_window)
+        self.message_ids = set()
+        self.last_created_at = ""
+        # Delta fetches go by the database-assigned seq (created_at is set by
+        # the writing worker before the row is saved). seq is assigned on
+        # insert, not on commit, so a row can become visible after one with a
+        # higher seq. A read's highest seq (cursor) therefore only becomes the
+        # fetch start (since) once a later read began at least overlap
+        # seconds after it; the rows fetched again are dropped by id.
+        # Messages added locally (no seq) move neither.
+        self.overlap = overlap
+        self.cursor = None
+        self.since = None
+        self._reads = deque()  # (finished at, cursor) of reads not settled yet
+        self.loaded_at = self.synced_at = self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.add_messages(messages, from_db=True)
+
+    def add_messages(self, messages, from_db: bool = False, read_started: float = None) -> int:
+        """Append messages not seen yet (by id), keeping created_at order; returns how many were new.
+
+        from_db marks the result of a database read that started at
+        read_started (monotonic; None for the initial load).
+        """
+        if from_db:
+            self._advance(messages, read_started)
+        new = [m for m in messages if m.get('id') is None or m['id'] not in self.message_ids]
+        if not new:
+            return 0
+        new.sort(key=lambda m: m.get('created_at') or '')
+        if self.messages and (new[0].get('created_at') or '') < self.last_created_at:
+            # a late write from another worker landed inside the window: re-merge
+            merged = sorted(list(self.messages) + new, key=lambda m: m.get('created_at') or '')
+            self.messages.clear()
+            self.messages.extend(merged)
+        else:
+            self.messages.extend(new)
+        self.message_ids = {m['id'] for m in self.messages if m.get('id') is not None}
+        self.last_created_at = max(self.last_created_at, *(m.get('created_at') or '' for m in new))
+        return len(new)
+
+    def _advance(self, messages, read_started):
+        seqs = [m['seq'] for m in messages if m.get('seq') is not None]
+        if read_started is None and seqs:
+            # a late commit below the loaded window is re-read until the load settles
+            self.since = min(seqs) - 1
+        elif read_started is not None:
+            # this read began overlap seconds after these finished: anything
+            # below their cursor has committed by now and was just read
+            while self._reads and self._reads[0][0] <= read_started - self.overlap:
+                self.since = self._reads.popleft()[1]
+        if seqs:
+            self.cursor = max(seqs) if self.cursor is None else max(self.cursor, *seqs)
+        self._reads.append((time.monotonic(), self.cursor))
+
+    def participant(self, user_id: str, is_self: bool = True):
+        return next((p for p in self.participants if (p['id'] == user_id) == is_self), None)
+
+
+class ConversationCache:
+    """
+    In-process cache of conversation participants and recent history.
+    The first access loads the conversation once (load_fn); later accesses only
+    fetch messages stored since the last few seconds of reads (delta_fn), so the cost
+    per message no longer grows with conversation length. Writes by other
+    workers are picked up by that delta fetch; duplicates are dropped by
+    message id. At most history_window messages are kept per conversation,
+    and conversations are evicted LRU beyond max_conversations or after
+    idle_ttl seconds without use. Participants are reloaded every
+    participants_ttl seconds. Delta fetches re-read delta_overlap seconds
+    worth of rows, so a write that commits out of seq order is still seen
+    (see ConversationState).
+
+    load_fn(conversation_id) -> (participants, messages) or None
+    delta_fn(conversation_id, since_seq) -> messages with a seq above it (all if None)
+    Both are blocking and run through `run` (e.g. BlockingIO.run).
+    pending_fn(conversation_id) -> messages accepted but not written yet;
+    they are merged into every (re)load so a write-behind queue stays visible.
+    """
+
+    def __init__(self, load_fn, delta_fn, run, max_conversations: int = 1000, history_window: int = 50,
+                 idle_ttl: float = 900.0, participants_ttl: float = 300.0, sync_interval: float = 0.0,
+                 pending_fn=None, delta_overlap: float = 5.0):
+        self.load_fn = load_fn
+        self.delta_overlap = delta_overlap
+        self.delta_fn = delta_fn
+        self.pending_fn = pending_fn
+        self.run = run
+        self.max_conversations = max_conversations
+        self.history_window = history_window
+        self.idle_ttl = idle_ttl
+        self.participants_ttl = participants_ttl
+        self.sync_interval = sync_interval
+        self._states: "OrderedDict[str, ConversationState]" = OrderedDict()
+        self._loading = {}
+        self.full_loads = 0
+        self.delta_fetches = 0
+        self.delta_messages = 0
+        self.evictions = 0
+
+    async def get(self, conversation_id: str):
+        """Up-to-date state of a conversation, or None if it does not exist."""
+        self._evict_idle()
+        state = self._states.get(conversation_id)
+        if state is None or time.monotonic() - state.loaded_at > self.participants_ttl:
+            state = await self._load(conversation_id)
+            if state is None:
+                return None
+        else:
+            async with state.lock:
+                if time.monotonic() - state.synced_at >= self.sync_interval:
+                    started = time.monotonic()
+                    messages = await self.run(self.delta_fn, conversation_id, state.since)
+                    self.delta_fetches += 1
+                    self.delta_messages += state.add_messages(messages, from_db=True, read_started=started)
+                    state.synced_at = time.monotonic()
+        state.last_used = time.monotonic()
+        # the awaits above may have let LRU/idle eviction drop the entry, or a
+        # concurrent reload replace it: keep whichever state is cached now
+        current = self._states.get(conversation_id)
+        if current is None:
+            self._states[conversation_id] = state
+            self._trim()
+        else:
+            state = current
+        self._states.move_to_end(conversation_id)
+        return state
+
+    async def _load(self, conversation_id: str):
+        # concurrent first accesses share one load
+        task = self._loading.get(conversation_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_once(conversation_id))
+            self._loading[conversation_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(conversation_id, None))
+        return await asyncio.shield(task)
+
+    async def _load_once(self, conversation_id: str):
+        loaded = await self.run(self.load_fn, conversation_id)
+        self.full_loads += 1
+        if not loaded:
+            self._states.pop(conversation_id, None)
+            return None
+        participants, messages = loaded
+        state = ConversationState(conversation_id, participants, messages, self.history_window, self.delta_overlap)
+        if self.pending_fn is not None:
+            # queued rows carry only sender_id; attach the profile like the database rows have
+            state.add_messages([m if m.get('sender') else {**m, 'sender': state.participant(m['sender_id'])}
+                                for m in self.pending_fn(conversation_id)])
+        self._states[conversation_id] = state
+        self._trim()
+        return state
+
+    def _trim(self):
+        while len(self._states) > self.max_conversations:
+            self._states.popitem(last=False)
+            self.evictions += 1
+
+    def add_message(self, conversation_id: str, message: dict):
+        """Record a message this worker just wrote, so the next delta fetch does not return it as new."""
+        state = self._states.get(conversation_id)
+        if state is not None:
+            state.add_messages([message])
+
+    def invalidate(self, conversation_id: str):
+        self._states.pop(conversation_id, None)
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._states:
+            oldest_id, oldest = next(iter(self._states.items()))
+            if oldest.last_used >= cutoff:
+                break
+            del self._states[oldest_id]
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._states),
+            "max_conversations": self.max_conversations,
+            "history_window": self.history_window,
+            "full_loads": self.full_loads,
+            "delta_fetches": self.delta_fetches,
+            "delta_messages": self.delta_messages,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,113 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); good enough for budgeting a prompt."""
+    return (len(text) + 3) // 4
+
+
+class ConversationSummary:
+    def __init__(self):
+        self.text = ""
+        self.until = ""  # created_at of the newest message folded into text
+        self.folding = None  # the fold in progress, shared by concurrent builds
+
+
+class HistoryCompactor:
+    """
+    Keeps the history part of an LLM prompt within token_budget.
+    Recent turns are kept verbatim; once they no longer fit, the older ones
+    are folded into a rolling per-conversation summary by
+    summarize_fn(previous_summary, lines) (async, returns the new summary).
+    Each fold keeps only about half of the verbatim budget, so a summary is
+    updated every few turns rather than on every message, and it only ever
+    receives turns it has not seen. If summarizing fails, the oldest turns
+    are dropped instead.
+    """
+
+    def __init__(self, summarize_fn, token_budget: int = 600, summary_tokens: int = 150,
+                 max_conversations: int = 1000, window: int = 2000):
+        self.summarize_fn = summarize_fn
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.max_conversations = max_conversations
+        self._summaries: "OrderedDict[str, ConversationSummary]" = OrderedDict()
+        self._prompt_tokens = deque(maxlen=window)
+        self._summary_ms = deque(maxlen=window)
+        self.folds = 0
+        self.folded_turns = 0
+        self.fallbacks = 0
+
+    def _summary(self, conversation_id: str) -> ConversationSummary:
+        summary = self._summaries.get(conversation_id)
+        if summary is None:
+            summary = self._summaries[conversation_id] = ConversationSummary()
+            while len(self._summaries) > self.max_conversations:
+                self._summaries.popitem(last=False)
+        self._summaries.move_to_end(conversation_id)
+        return summary
+
+    async def build(self, conversation_id: str, turns) -> str:
+        """History text for turns [(created_at, line), ...], oldest first, created_at strictly increasing."""
+        summary = self._summary(conversation_id)
+        pending = [(at, line) for at, line in turns if at > summary.until]
+        sizes = [estimate_tokens(line) + 1 for _, line in pending]
+        if estimate_tokens(summary.text) + sum(sizes) > self.token_budget:
+            if summary.folding is None:
+                summary.folding = asyncio.ensure_future(self._fold(summary, pending, sizes))
+                summary.folding.add_done_callback(lambda _: setattr(summary, "folding", None))
+            # a cancelled suggestion must not throw away a summary that is nearly done
+            await asyncio.shield(summary.folding)
+            pending = [(at, line) for at, line in pending if at > summary.until]
+        lines = [line for _, line in pending]
+        # whatever a failed fold could not absorb is dropped, oldest first
+        budget = self.token_budget - estimate_tokens(summary.text)
+        while len(lines) > 1 and sum(estimate_tokens(l) + 1 for l in lines) > budget:
+            lines.pop(0)
+        history = "\n".join(lines)
+        if summary.text:
+            history = f"Summary of the earlier conversation: {summary.text}\n\n{history}"
+        self._prompt_tokens.append(estimate_tokens(history))
+        return history
+
+    async def _fold(self, summary: ConversationSummary, pending, sizes):
+        # keep the newest turns that fit in half of what the summary leaves free, fold the rest
+        keep_budget = (self.token_budget - self.summary_tokens) // 2
+        kept, cut = 0, len(pending)
+        while cut > 1 and kept + sizes[cut - 1] <= keep_budget:
+            cut -= 1
+            kept += sizes[cut]
+        cut = min(cut, len(pending) - 1)  # the newest turn always stays verbatim
+        folded = pending[:cut]
+        if not folded:
+            return
+        start = time.perf_counter()
+        try:
+            text = await self.summarize_fn(summary.text, [line for _, line in folded])
+        except Exception as e:
+            print(f"Error summarizing conversation history: {e!r}")
+            self.fallbacks += 1
+            return
+        self._summary_ms.append((time.perf_counter() - start) * 1000)
+        summary.text = " ".join(text.split())[:self.summary_tokens * 4]
+        summary.until = folded[-1][0]
+        self.folds += 1
+        self.folded_turns += len(folded)
+
+    def stats(self) -> dict:
+        tokens = np.asarray(self._prompt_tokens) if self._prompt_tokens else np.zeros(1)
+        summary_ms = np.asarray(self._summary_ms) if self._summary_ms else np.zeros(1)
+        return {
+            "token_budget": self.token_budget,
+            "conversations": len(self._summaries),
+            "history_tokens_p50": float(np.percentile(tokens, 50)),
+            "history_tokens_max": int(tokens.max()),
+            "folds": self.folds,
+            "folded_turns": self.folded_turns,
+            "fallbacks": self.fallbacks,
+            "summary_p50_ms": float(np.percentile(summary_ms, 50)),
+        }
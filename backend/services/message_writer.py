@@ -0,0 +1,207 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages.
+    submit() gives the message its id and created_at, queues it and returns
+    the row without waiting for the database. One flusher task writes the
+    queue in order as multi-row inserts of up to max_batch rows, at most
+    max_wait_ms after the first queued row. A failed batch is retried with
+    exponential backoff (capped at max_backoff) until it goes through; nothing
+    behind it is written before it, so the order within a conversation is
+    kept, and an outage only fills the queue. Because ids are assigned here,
+    insert_many should ignore rows that already exist, which makes a retry
+    after a lost response safe. When max_queue rows are waiting, submit()
+    blocks (backpressure). close() flushes what is left; rows that still
+    could not be written are saved to a file in spill_dir and written first
+    by the next writer started with the same spill_dir.
+
+    insert_many(rows) is blocking and runs through `run` (e.g. BlockingIO.run).
+    """
+
+    def __init__(self, insert_many, run, max_batch: int = 100, max_wait_ms: float = 50.0, max_queue: int = 10_000,
+                 backoff: float = 0.2, max_backoff: float = 5.0, spill_dir: str = None):
+        self.insert_many = insert_many
+        self.run = run
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spill_dir = spill_dir
+        self._queue: asyncio.Queue = None
+        self.max_queue = max_queue
+        self._flusher = None
+        self._unflushed = {}   # conversation_id -> deque of rows not written yet
+        self._last_created = {}  # conversation_id -> last created_at handed out by this worker
+        self._replay = []      # rows spilled by an earlier writer, written before the queue
+        self._claimed = []     # spill files those rows came from, removed once they are written
+        self._failing_since = None
+        self.submitted = 0
+        self.written = 0
+        self.batches = 0
+        self.retries = 0
+        self.blocked = 0
+        self.spilled = 0
+        self.replayed = 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._replay = self._claim_spilled()
+        for row in self._replay:
+            self._unflushed.setdefault(row["conversation_id"], deque()).append(row)
+        self._flusher = asyncio.create_task(self._flush_forever())
+
+    def _claim_spilled(self) -> list:
+        # renaming a file claims it, so of several workers sharing spill_dir only one replays it
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return []
+        rows = []
+        for name in sorted(os.listdir(self.spill_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            claimed = os.path.join(self.spill_dir, f"{name}.{os.getpid()}.claimed")
+            try:
+                os.rename(os.path.join(self.spill_dir, name), claimed)
+                with open(claimed) as f:
+                    rows.extend(json.loads(line) for line in f if line.strip())
+            except (OSError, ValueError) as e:
+                print(f"Error reading spilled messages {name}: {e!r}")
+                continue
+            self._claimed.append(claimed)
+        if rows:
+            print(f"✅ Replaying {len(rows)} messages saved by an earlier shutdown")
+        return rows
+
+    def _spill(self, rows):
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"unsaved-{time.time_ns()}-{os.getpid()}.jsonl")
+        with open(f"{path}.tmp", "w") as f:
+            f.writelines(json.dumps(row) + "\n" for row in rows)
+        os.replace(f"{path}.tmp", path)
+        self.spilled += len(rows)
+        print(f"Saved {len(rows)} unwritten messages to {path}; they are written on the next start")
+
+    def _created_at(self, conversation_id: str) -> str:
+        # strictly increasing per conversation, even for messages in the same microsecond
+        now = datetime.now(timezone.utc)
+        last = self._last_created.get(conversation_id)
+        if last is not None and now <= last:
+            now = last + timedelta(microseconds=1)
+        self._last_created[conversation_id] = now
+        return now.isoformat()
+
+    async def submit(self, conversation_id: str, sender_id: str, text: str) -> dict:
+        row = {"id": str(uuid.uuid4()), "conversation_id": conversation_id, "sender_id": sender_id,
+               "original_text": text, "created_at": self._created_at(conversation_id)}
+        if self._queue.full():
+            self.blocked += 1
+        await self._queue.put(row)
+        self._unflushed.setdefault(conversation_id, deque()).append(row)
+        self.submitted += 1
+        return row
+
+    def pending(self, conversation_id: str) -> list:
+        """Rows of a conversation that are queued or being written (for read-your-writes)."""
+        return list(self._unflushed.get(conversation_id, ()))
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush_forever(self):
+        while self._replay:
+            batch = self._replay[:self.max_batch]
+            await self._write(batch)
+            del self._replay[:len(batch)]
+            self.replayed += len(batch)
+        for path in self._claimed:
+            os.remove(path)
+        self._claimed = []
+        while True:
+            batch = await self._next_batch()
+            await self._write(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    async def _write(self, batch):
+        delay = self.backoff
+        attempt = 0
+        while True:
+            try:
+                await self.run(self.insert_many, batch)
+                self.written += len(batch)
+                self.batches += 1
+                self._failing_since = None
+                break
+            except Exception as e:
+                attempt += 1
+                self.retries += 1
+                if self._failing_since is None:
+                    self._failing_since = time.monotonic()
+                print(f"Error saving {len(batch)} messages (attempt {attempt}, failing for "
+                      f"{time.monotonic() - self._failing_since:.0f}s, {self._queue.qsize()} queued), "
+                      f"retrying in {delay:.1f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+        for row in batch:
+            rows = self._unflushed.get(row["conversation_id"])
+            if rows is not None:
+                rows.remove(row)
+                if not rows:
+                    del self._unflushed[row["conversation_id"]]
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "written": self.written,
+            "batches": self.batches,
+            "rows_per_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "retries": self.retries,
+            "failing_s": round(time.monotonic() - self._failing_since, 1) if self._failing_since else 0.0,
+            "unsaved": sum(len(rows) for rows in self._unflushed.values()),
+            "blocked_submits": self.blocked,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+        }
+
+    async def close(self, timeout: float = 30.0):
+        """
+        Write everything still queued (waiting at most timeout seconds), then stop
+        the flusher. Rows left over are spilled to spill_dir, if set.
+        """
+        if self._flusher is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._flusher.cancel()
+        await asyncio.gather(self._flusher, return_exceptions=True)
+        self._flusher = None
+        # a batch cut off mid-insert may still land; its replay is then skipped by id
+        unsaved = [row for rows in self._unflushed.values() for row in rows]
+        if unsaved and self.spill_dir:
+            self._spill(unsaved)
+            for path in self._claimed:
+                os.remove(path)
+            self._claimed = []
+        elif unsaved:
+            print(f"Message writer closed with {len(unsaved)} unsaved messages")
@@ -0,0 +1,275 @@
+# model_registry.py
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from services.model_utils import load_model_and_preproc
+from services.artifact import load_artifact
+from services.predictor import predict_many, model_version
+
+DEFAULT_SEGMENT = None
+
+def load_model_pair(model_path, preproc_path=None):
+    """(model, preproc) from an artifact directory or a pickle pair."""
+    if os.path.isdir(model_path):
+        return load_artifact(model_path)
+    return load_model_and_preproc(model_path, preproc_path or "preprocessor.pkl")
+
+class ModelVersion:
+    """One loaded (model, preproc) pair and the number of requests using it."""
+
+    def __init__(self, model, preproc, source):
+        self.model = model
+        self.preproc = preproc
+        self.source = source
+        self.version = model_version(model, preproc)
+        self.loaded_at = time.time()
+        self.refs = 0
+        self.retired = False
+
+    def info(self):
+        return {'version': self.version, 'source': self.source, 'loaded_at': self.loaded_at,
+                'in_flight': self.refs, 'retired': self.retired}
+
+class ModelRegistry:
+    """Serves price models that can be replaced without a restart.
+
+    ``load`` (or ``load_async``, on a background thread) loads a new
+    version, checks it against the smoke rows and only then makes it the
+    active version for its segment, in one locked assignment. Requests
+    take a version with ``acquire``, so a request that started on the old
+    version finishes on it. The last ``max_versions`` versions of a
+    segment are kept for ``rollback``; older ones are dropped as soon as
+    no request holds them.
+
+    Segments (e.g. one model per ``region``) are registered with
+    ``register_segment`` and loaded on first use; rows whose
+    ``segment_col`` value has no segment use the default model. So do the
+    rows of a segment whose model failed to load or failed the smoke
+    check; the load is retried after ``retry_backoff`` seconds, doubling
+    up to ``max_retry_backoff``.
+    """
+
+    def __init__(self, smoke_rows=None, segment_col=None, max_versions=2, loader=load_model_pair,
+                 retry_backoff=5.0, max_retry_backoff=300.0):
+        self.smoke_rows = pd.DataFrame(smoke_rows) if smoke_rows is not None else None
+        self.segment_col = segment_col
+        self.max_versions = max_versions
+        self.loader = loader
+        self.retry_backoff = retry_backoff
+        self.max_retry_backoff = max_retry_backoff
+        self._lock = threading.Lock()
+        self._active = {}        # segment -> ModelVersion
+        self._history = {}       # segment -> [ModelVersion], newest last
+        self._sources = {}       # segment -> (model_path, preproc_path), not loaded yet
+        self._segment_locks = {}
+        self._failures = {}      # segment -> {'error', 'attempts', 'retry_at'} of its last failed load
+        self._draining = []      # dropped from history but still in use
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self.swaps = 0
+        self.rejected = 0
+        # bumped on every activation or rollback; a cache tag for "any model changed"
+        self.generation = 0
+
+    # --- loading ---
+    def validate(self, model, preproc):
+        """Run the smoke rows through the candidate; raises ValueError if it misbehaves."""
+        if self.smoke_rows is None or self.smoke_rows.empty:
+            return
+        prices, info = predict_many(model, self.smoke_rows, preproc)
+        passed = info['is_similar'].to_numpy()
+        if not passed.any():
+            raise ValueError("Smoke check failed: no smoke row passed the similarity gate")
+        bad = ~np.isfinite(prices[passed]) | (prices[passed] < 0)
+        if bad.any():
+            raise ValueError(f"Smoke check failed: {int(bad.sum())} invalid predicted prices")
+
+    def load(self, model_path, preproc_path=None, segment=DEFAULT_SEGMENT):
+        """Load, validate and activate a version; returns its version tag."""
+        model, preproc = self.loader(model_path, preproc_path)
+        try:
+            self.validate(model, preproc)
+        except Exception:
+            self.rejected += 1
+            raise
+        return self._activate(ModelVersion(model, preproc, model_path), segment)
+
+    def load_async(self, model_path, preproc_path=None, segment=DEFAULT_SEGMENT):
+        """``load`` on the background loader thread; returns a Future of the version tag."""
+        return self._executor.submit(self.load, model_path, preproc_path, segment)
+
+    def _activate(self, entry, segment):
+        with self._lock:
+            previous = self._active.get(segment)
+            self._active[segment] = entry
+            history = self._history.setdefault(segment, [])
+            history.append(entry)
+            if previous is not None:
+                previous.retired = True
+                self.swaps += 1
+            self.generation += 1
+            self._failures.pop(segment, None)
+            self._draining.extend(e for e in history[:-self.max_versions] if e.refs)
+            del history[:-self.max_versions]
+        print(f"✅ Model version {entry.version} active for segment {segment!r}")
+        return entry.version
+
+    def rollback(self, segment=DEFAULT_SEGMENT):
+        """Re-activate the previous version of a segment; returns its version tag."""
+        with self._lock:
+            history = self._history.get(segment, [])
+            if len(history) < 2:
+                raise ValueError(f"No previous model version for segment {segment!r}")
+            current = history.pop()
+            current.retired = True
+            if current.refs:
+                self._draining.append(current)
+            entry = history[-1]
+            entry.retired = False
+            self._active[segment] = entry
+            self.swaps += 1
+            self.generation += 1
+        return entry.version
+
+    # --- segments ---
+    def register_segment(self, segment, model_path, preproc_path=None):
+        """Model for one segment value, loaded on its first request."""
+        segment = segment.strip().lower()
+        with self._lock:
+            self._sources[segment] = (model_path, preproc_path)
+            self._failures.pop(segment, None)
+
+    def segments(self):
+        with self._lock:
+            return sorted(set(self._sources) | {s for s in self._active if s is not DEFAULT_SEGMENT})
+
+    def _resolve(self, segment):
+        if segment is DEFAULT_SEGMENT or segment in self._active:
+            return segment
+        source = self._sources.get(segment)
+        if source is None:
+            return DEFAULT_SEGMENT
+        # load each segment once even if several requests arrive together
+        with self._lock:
+            seg_lock = self._segment_locks.setdefault(segment, threading.Lock())
+        with seg_lock:
+            if segment in self._active:
+                return segment
+            failure = self._failures.get(segment)
+            if failure is not None and time.monotonic() < failure['retry_at']:
+                return DEFAULT_SEGMENT
+            try:
+                self.load(*source, segment=segment)
+            except Exception as e:
+                attempts = failure['attempts'] + 1 if failure is not None else 1
+                delay = min(self.retry_backoff * 2 ** (attempts - 1), self.max_retry_backoff)
+                with self._lock:
+                    self._failures[segment] = {'error': repr(e), 'attempts': attempts,
+                                               'retry_at': time.monotonic() + delay}
+                print(f"Model for segment {segment!r} failed to load, using the default model "
+                      f"for {delay:.1f}s: {e!r}")
+                return DEFAULT_SEGMENT
+        return segment
+
+    def segment_of(self, row):
+        if self.segment_col is None:
+            return DEFAULT_SEGMENT
+        value = row.get(self.segment_col)
+        return value.strip().lower() if isinstance(value, str) else DEFAULT_SEGMENT
+
+    # --- serving ---
+    @contextmanager
+    def acquire(self, segment=DEFAULT_SEGMENT):
+        """Pin the active version of a segment for the duration of a request."""
+        segment = self._resolve(segment)
+        with self._lock:
+            entry = self._active.get(segment)
+            if entry is None:
+                raise LookupError("No model version loaded")
+            entry.refs += 1
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                entry.refs -= 1
+                if not entry.refs and entry in self._draining:
+                    self._draining.remove(entry)
+
+    def active(self, segment=DEFAULT_SEGMENT):
+        with self._lock:
+            return self._active.get(segment)
+
+    def predict_many(self, rows_df, min_cat_matches=3, text_threshold=0.6):
+        """``predictor.predict_many``, routing each row to its segment's model.
+
+        Raises the first error of any segment; see ``predict_by_segment``.
+        """
+        prices, info, errors = self.predict_by_segment(rows_df, min_cat_matches, text_threshold)
+        if errors:
+            raise next(iter(errors.values()))
+        return prices, info
+
+    def predict_by_segment(self, rows_df, min_cat_matches=3, text_threshold=0.6):
+        """``predict_many`` that keeps a failing segment from failing the other rows.
+
+        Returns (prices, info, errors). ``errors`` maps row positions to the
+        exception of their segment; those rows get a NaN price. ``info`` has
+        a ``generation`` column: the registry generation read before any
+        version was pinned, so a result is only as new as that generation.
+        """
+        rows_df = pd.DataFrame(rows_df).reset_index(drop=True)
+        generation = self.generation
+        segments = [self.segment_of(row) for row in rows_df.to_dict('records')]
+        prices = np.full(len(rows_df), np.nan)
+        info = pd.DataFrame({'is_similar': np.zeros(len(rows_df), dtype=bool),
+                             'max_cat_matches': np.zeros(len(rows_df), dtype=np.int64),
+                             'max_text_similarity': np.full(len(rows_df), np.nan)})
+        errors = {}
+        for segment in dict.fromkeys(segments):
+            rows = np.flatnonzero([s == segment for s in segments])
+            part = rows_df if len(rows) == len(rows_df) else rows_df.iloc[rows]
+            try:
+                with self.acquire(segment) as entry:
+                    p, i = predict_many(entry.model, part, entry.preproc, min_cat_matches, text_threshold)
+            except Exception as e:
+                errors.update(dict.fromkeys(rows.tolist(), e))
+                continue
+            prices[rows] = p
+            for c in info.columns:
+                info.loc[rows, c] = i[c].to_numpy()
+        info['generation'] = generation
+        return prices, info, errors
+
+    def drain(self, version, timeout=30.0):
+        """Wait until no request holds ``version``; returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                entries = [e for h in self._history.values() for e in h] + self._draining
+                held = any(e.refs for e in entries if e.version == version)
+            if not held:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': {str(s): e.info() for s, e in self._active.items()},
+                'history': {str(s): [e.info() for e in h] for s, h in self._history.items()},
+                'registered_segments': sorted(map(str, self._sources)),
+                'segment_failures': {
+                    str(s): {'error': f['error'], 'attempts': f['attempts'],
+                             'retry_in_s': round(max(0.0, f['retry_at'] - time.monotonic()), 1)}
+                    for s, f in self._failures.items()
+                },
+                'swaps': self.swaps,
+                'rejected': self.rejected,
+                'generation': self.generation,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
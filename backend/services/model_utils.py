@@ -1,47 +1,364 @@
+import os
+import json
+import shutil
+import time
+import hashlib
 import joblib
 import numpy as np
+import pandas as pd
 import lightgbm as lgb
-from sklearn.model_selection import train_test_split
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from sklearn.model_selection import train_test_split, KFold, ParameterGrid
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-from services.config import RANDOM_STATE
+from services.preprocessing import fit_preprocessor, transform_with_preprocessor, normalize_frame
+from services.similarity import text_gate_agreement, extend_gate
+from services.config import RANDOM_STATE, RETRAIN_DRIFT_THRESHOLD, CV_FOLDS, DATASET_CACHE_DIR, GATE_EVAL_ROWS
 
-def train_model(X_full_df, y_series, cat_cols=None):
+MODEL_PARAMS = dict(
+    objective='regression',
+    n_estimators=10000,
+    learning_rate=0.05,
+    num_leaves=31,
+    random_state=RANDOM_STATE,
+    n_jobs=-1,
+)
+
+# LightGBM Dataset (binning) parameters; part of the dataset cache key
+DATASET_PARAMS = dict(
+    max_bin=255,
+    verbose=-1,
+)
+
+def _booster_params(params):
+    # LGBMRegressor keyword names -> lgb.train parameters
+    params = dict(params)
+    params.pop('n_estimators', None)
+    params['seed'] = params.pop('random_state', RANDOM_STATE)
+    params['num_threads'] = max(0, params.pop('n_jobs', 0))
+    return params
+
+def _validation_metrics(y_val_log, y_pred_val_log):
+    y_pred_val = np.expm1(y_pred_val_log)
+    y_val_orig = np.expm1(y_val_log)
+    return {
+        'MAE': mean_absolute_error(y_val_orig, y_pred_val),
+        'RMSE': mean_squared_error(y_val_orig, y_pred_val, squared=False),
+        'R2': r2_score(y_val_orig, y_pred_val)
+    }
+
+def _dataset_key(X_full_df, y_log, cat_cols):
+    # content hash of everything that determines the binned datasets: the
+    # feature values, column layout and category lists, the target, the
+    # train/validation split and the binning parameters
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(X_full_df, index=False).to_numpy().tobytes())
+    h.update(np.ascontiguousarray(y_log, dtype=np.float64).tobytes())
+    layout = {
+        'columns': [str(c) for c in X_full_df.columns],
+        'dtypes': [str(d) for d in X_full_df.dtypes],
+        'categories': {c: X_full_df[c].cat.categories.astype(str).tolist() for c in cat_cols},
+        'cat_cols': list(cat_cols),
+        'split': [0.2, RANDOM_STATE],
+        'dataset_params': DATASET_PARAMS,
+        'lightgbm': lgb.__version__,
+    }
+    h.update(json.dumps(layout, sort_keys=True).encode())
+    return h.hexdigest()
+
+def _training_datasets(X_train, y_tr, X_val, y_val, cat_cols, key, cache_dir):
+    """Binned train/validation Datasets, loaded from or saved to ``cache_dir/key``."""
+    entry = os.path.join(cache_dir, key) if cache_dir else None
+    if entry and os.path.exists(os.path.join(entry, "meta.json")):
+        with open(os.path.join(entry, "meta.json")) as f:
+            meta = json.load(f)
+        train_set = lgb.Dataset(os.path.join(entry, "train.bin"), params=DATASET_PARAMS).construct()
+        val_set = lgb.Dataset(os.path.join(entry, "val.bin"), reference=train_set,
+                              params=DATASET_PARAMS).construct()
+        # the binary format keeps bin mappers but not the pandas category lists
+        train_set.pandas_categorical = meta['pandas_categorical']
+        return train_set, val_set, True
+
+    categorical = cat_cols if cat_cols else 'auto'
+    train_set = lgb.Dataset(X_train, label=y_tr, categorical_feature=categorical,
+                            params=DATASET_PARAMS, free_raw_data=False).construct()
+    val_set = lgb.Dataset(X_val, label=y_val, reference=train_set, categorical_feature=categorical,
+                          params=DATASET_PARAMS, free_raw_data=False).construct()
+    if entry:
+        tmp = f"{entry}.tmp-{os.getpid()}"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        train_set.save_binary(os.path.join(tmp, "train.bin"))
+        val_set.save_binary(os.path.join(tmp, "val.bin"))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({'pandas_categorical': train_set.pandas_categorical,
+                       'feature_names': [str(c) for c in X_train.columns]}, f)
+        try:
+            os.replace(tmp, entry)
+        except OSError:   # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+    return train_set, val_set, False
+
+def train_model(X_full_df, y_series, cat_cols=None, cache_dir=DATASET_CACHE_DIR, preproc=None):
+    """Train the price model on log1p(price) with early stopping.
+
+    The binned LightGBM train/validation Datasets are cached in LightGBM's
+    binary format under ``cache_dir``, keyed by a hash of the features,
+    target, split and binning parameters, so retraining on an unchanged
+    preprocessor output skips binning. Any change to the ``fit_preprocessor``
+    output gives a new key. Pass ``cache_dir=None`` to disable the cache.
+    With the ``preproc`` that produced ``X_full_df``, the metrics also
+    report how the similarity index (precision / search mode) changes the
+    text-gate decision on up to ``GATE_EVAL_ROWS`` validation rows.
+    Returns a ``lgb.Booster``.
+    """
+    start = time.perf_counter()
     y_log = np.log1p(y_series.values)
+    if cat_cols is None:
+        cat_cols = [c for c in X_full_df.columns if isinstance(X_full_df[c].dtype, pd.CategoricalDtype)]
     X_train, X_val, y_tr, y_val = train_test_split(
         X_full_df, y_log, test_size=0.2, random_state=RANDOM_STATE
     )
 
-    model = lgb.LGBMRegressor(
-        objective='regression',
-        n_estimators=10000,
-        learning_rate=0.05,
-        num_leaves=31,
-        random_state=RANDOM_STATE,
-        n_jobs=-1,
-        categorical_feature=cat_cols
-    )
+    key = _dataset_key(X_full_df, y_log, cat_cols) if cache_dir else None
+    train_set, val_set, cached = _training_datasets(X_train, y_tr, X_val, y_val, cat_cols, key, cache_dir)
+    bin_seconds = time.perf_counter() - start
 
-    model.fit(
-        X_train,
-        y_tr,
-        eval_set=[(X_val, y_val)],
+    model = lgb.train(
+        _booster_params(MODEL_PARAMS),
+        train_set,
+        num_boost_round=MODEL_PARAMS['n_estimators'],
+        valid_sets=[val_set],
         callbacks=[
             lgb.early_stopping(stopping_rounds=100),
             lgb.log_evaluation(period=100)
         ]
     )
 
-    y_pred_val_log = model.predict(X_val)
-    y_pred_val = np.expm1(y_pred_val_log)
-    y_val_orig = np.expm1(y_val)
+    metrics = _validation_metrics(y_val, model.predict(X_val))
+    metrics['train_seconds'] = time.perf_counter() - start
+    metrics['dataset_seconds'] = bin_seconds
+    metrics['dataset_cached'] = cached
+    if preproc is not None and preproc.get('X_svd_array') is not None:
+        val_rows = X_full_df.index.get_indexer(X_val.index)[:GATE_EVAL_ROWS]
+        metrics.update(text_gate_agreement(preproc, val_rows))
+    # kept on the model so a later update_model can measure drift against it
+    model.val_metrics_ = metrics
 
-    metrics = {
-        'MAE': mean_absolute_error(y_val_orig, y_pred_val),
-        'RMSE': mean_squared_error(y_val_orig, y_pred_val, squared=False),
-        'R2': r2_score(y_val_orig, y_pred_val)
+    return model, metrics
+
+def _align_categories(X, booster):
+    # continued trees must see the same category codes as the trees they extend
+    if not booster.pandas_categorical:
+        return X
+    X = X.copy()
+    cat_cols = [c for c in X.columns if isinstance(X[c].dtype, pd.CategoricalDtype)]
+    for c, categories in zip(cat_cols, booster.pandas_categorical):
+        X[c] = X[c].cat.set_categories(categories)
+    return X
+
+def update_model(model, preproc, df_new, df_full=None,
+                 drift_threshold=RETRAIN_DRIFT_THRESHOLD, n_new_estimators=1000):
+    """Refresh a trained model with new listings.
+
+    By default boosting continues from the existing booster on ``df_new``,
+    transformed with the existing category vocabularies and TF-IDF/SVD
+    projection, and the returned preproc is a copy whose similarity gate
+    also covers the new listings. If the current model's MAE on the new listings is more than
+    ``drift_threshold`` (relative) above its own validation MAE, the
+    preprocessor and model are refit from scratch on ``df_full`` + ``df_new``
+    instead. Without ``df_full`` there is nothing to refit on (``df_new``
+    alone would throw the previous training set away), so the update stays
+    incremental and ``report['retrain_needed']`` is set.
+
+    Returns (model, preproc, metrics, report); model is a ``lgb.Booster``
+    in both modes and ``report`` holds the mode used, the measured drift,
+    whether a full retrain is still needed and wall-clock time saved
+    against the last full retrain.
+    """
+    start = time.perf_counter()
+    # models pickled before both trainers returned a Booster are LGBMRegressors
+    booster = getattr(model, 'booster_', model)
+    baseline = getattr(model, 'val_metrics_', None)
+
+    df_new = normalize_frame(df_new, preproc['cat_cols'])
+    X_new, X_new_tfidf, X_new_svd = transform_with_preprocessor(df_new, preproc, use_embedder=False)
+    X_new = _align_categories(X_new, booster)
+    y_new = df_new['price'].astype(float)
+
+    prev_mae = mean_absolute_error(y_new, np.expm1(model.predict(X_new)))
+    drift = prev_mae / baseline['MAE'] - 1 if baseline else 0.0
+
+    retrain_needed = drift > drift_threshold and df_full is None
+    if retrain_needed:
+        print(f"Drift {drift:.1%} is above {drift_threshold:.0%} but no df_full was given; "
+              f"updating incrementally, a full retrain is needed")
+    if drift > drift_threshold and df_full is not None:
+        df_all = pd.concat([df_full, df_new], ignore_index=True)
+        preproc = fit_preprocessor(df_all)
+        model, metrics = train_model(preproc['X_full_df'], df_all['price'].astype(float), preproc['cat_cols'],
+                                     preproc=preproc)
+        mode = 'full'
+    else:
+        y_log = np.log1p(y_new.values)
+        X_train, X_val, y_tr, y_val = train_test_split(
+            X_new, y_log, test_size=0.2, random_state=RANDOM_STATE
+        )
+        cat_cols = [c for c in preproc['cat_cols'] if c in X_new.columns]
+        categorical = cat_cols if cat_cols else 'auto'
+        train_set = lgb.Dataset(X_train, label=y_tr, categorical_feature=categorical,
+                                params=DATASET_PARAMS, free_raw_data=False)
+        val_set = lgb.Dataset(X_val, label=y_val, reference=train_set, categorical_feature=categorical,
+                              params=DATASET_PARAMS, free_raw_data=False)
+        # same return type as train_model: the continued lgb.Booster
+        model = lgb.train(
+            _booster_params(MODEL_PARAMS),
+            train_set,
+            num_boost_round=n_new_estimators,
+            valid_sets=[val_set],
+            init_model=booster,
+            callbacks=[
+                lgb.early_stopping(stopping_rounds=100),
+                lgb.log_evaluation(period=100)
+            ]
+        )
+        metrics = _validation_metrics(y_val, model.predict(X_val))
+        # the similarity gate has to accept the listings the model now knows
+        preproc = extend_gate(preproc, X_new, X_new_svd, X_new_tfidf)
+        mode = 'incremental'
+
+    elapsed = time.perf_counter() - start
+    metrics['train_seconds'] = elapsed
+    full_seconds = baseline.get('train_seconds') if baseline else None
+    if mode == 'incremental' and baseline:
+        # later drift checks keep comparing against the last full retrain
+        model.val_metrics_ = baseline
+
+    report = {
+        'mode': mode,
+        'drift': drift,
+        'retrain_needed': retrain_needed,
+        'seconds': elapsed,
+        'full_retrain_seconds': full_seconds,
+        'seconds_saved': (full_seconds - elapsed) if full_seconds is not None and mode == 'incremental' else 0.0,
     }
+    print(f"✅ Model updated ({mode}), drift {drift:.1%}, {elapsed:.1f}s")
+    return model, preproc, metrics, report
 
-    return model, metrics
+
+# ------------------------------
+# Cross-validated training
+# ------------------------------
+# Worker-side state: the feature matrix attached from shared memory and the
+# training-fold LightGBM Datasets this worker has binned, by fold.
+_cv_state = {}
+
+def _cv_worker_init(shm_name, shape, cat_idx, n_threads):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _cv_state.update(shm=shm, X=data[:, :-1], y=data[:, -1], cat_idx=cat_idx,
+                     n_threads=n_threads, datasets={})
+
+def _cv_fit_fold(config, fold, n_folds):
+    folds = KFold(n_splits=n_folds, shuffle=True, random_state=RANDOM_STATE)
+    train_idx, val_idx = list(folds.split(np.arange(len(_cv_state['y']))))[fold]
+    # bin boundaries come from the training fold only, so nothing about the
+    # validation rows leaks into the features; reused across configs
+    train_set = _cv_state['datasets'].get(fold)
+    if train_set is None:
+        train_set = _cv_state['datasets'][fold] = lgb.Dataset(
+            _cv_state['X'][train_idx], label=_cv_state['y'][train_idx],
+            categorical_feature=_cv_state['cat_idx'],
+            params=dict(DATASET_PARAMS, num_threads=_cv_state['n_threads'])
+        ).construct()
+
+    params = dict(_booster_params(MODEL_PARAMS), num_threads=_cv_state['n_threads'], verbose=-1)
+    params.update(config)
+    X_val, y_val = _cv_state['X'][val_idx], _cv_state['y'][val_idx]
+    val_set = lgb.Dataset(X_val, label=y_val, reference=train_set,
+                          categorical_feature=_cv_state['cat_idx'])
+    booster = lgb.train(
+        params,
+        train_set,
+        num_boost_round=MODEL_PARAMS['n_estimators'],
+        valid_sets=[val_set],
+        categorical_feature=_cv_state['cat_idx'],
+        callbacks=[lgb.early_stopping(stopping_rounds=100, verbose=False)]
+    )
+    metrics = _validation_metrics(y_val, booster.predict(X_val, num_iteration=booster.best_iteration))
+    return {'config': config, 'fold': fold, 'best_iteration': booster.best_iteration, **metrics}
+
+def train_model_cv(X_full_df, y_series, cat_cols=None, n_folds=CV_FOLDS,
+                   param_grid=None, n_workers=None):
+    """K-fold cross-validated training, folds (x param_grid configs) in a process pool.
+
+    The feature matrix and log-target are copied once into shared memory
+    that every worker maps; each worker bins the training rows of a fold
+    into a LightGBM Dataset (validation rows never influence the bins),
+    reuses it for every config of that fold, and trains with threads limited to
+    cpu_count // n_workers. ``param_grid`` is an optional dict of lists
+    over ``num_leaves`` / ``learning_rate``. The config with the lowest mean
+    validation MAE is refit on all rows for the mean best iteration.
+
+    Returns (model, cv_report); model is a ``lgb.Booster`` like
+    ``train_model``'s and cv_report holds per-fold metrics, the best config
+    and its mean metrics.
+    """
+    start = time.perf_counter()
+    if cat_cols is None:
+        cat_cols = [c for c in X_full_df.columns if isinstance(X_full_df[c].dtype, pd.CategoricalDtype)]
+    cat_idx = [X_full_df.columns.get_loc(c) for c in cat_cols]
+    configs = list(ParameterGrid(param_grid)) if param_grid else [{}]
+    tasks = [(config, fold) for config in configs for fold in range(n_folds)]
+    n_workers = min(n_workers or os.cpu_count() or 1, len(tasks))
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    # features + log target as one float64 block; missing categories are NaN
+    n_rows, n_cols = X_full_df.shape
+    shm = shared_memory.SharedMemory(create=True, size=n_rows * (n_cols + 1) * 8)
+    try:
+        data = np.ndarray((n_rows, n_cols + 1), dtype=np.float64, buffer=shm.buf)
+        for j, c in enumerate(X_full_df.columns):
+            col = X_full_df[c]
+            if j in cat_idx:
+                codes = col.cat.codes.to_numpy()
+                data[:, j] = np.where(codes < 0, np.nan, codes)
+            else:
+                data[:, j] = col.to_numpy(dtype=np.float64)
+        data[:, -1] = np.log1p(y_series.to_numpy(dtype=np.float64))
+
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_cv_worker_init,
+                                 initargs=(shm.name, data.shape, cat_idx, n_threads)) as pool:
+            futures = [pool.submit(_cv_fit_fold, config, fold, n_folds) for config, fold in tasks]
+            folds = [f.result() for f in futures]
+        del data
+    finally:
+        shm.close()
+        shm.unlink()
+
+    summary = []
+    for i, config in enumerate(configs):
+        runs = folds[i * n_folds:(i + 1) * n_folds]
+        summary.append({
+            'config': config,
+            'MAE': float(np.mean([r['MAE'] for r in runs])),
+            'RMSE': float(np.mean([r['RMSE'] for r in runs])),
+            'R2': float(np.mean([r['R2'] for r in runs])),
+            'best_iteration': int(np.mean([r['best_iteration'] for r in runs])),
+        })
+    best = min(summary, key=lambda s: s['MAE'])
+
+    full_set = lgb.Dataset(X_full_df, label=np.log1p(y_series.values),
+                           categorical_feature=cat_cols if cat_cols else 'auto', params=DATASET_PARAMS)
+    model = lgb.train(dict(_booster_params(MODEL_PARAMS), **best['config']), full_set,
+                      num_boost_round=max(1, best['best_iteration']))
+
+    cv_metrics = {k: best[k] for k in ('MAE', 'RMSE', 'R2')}
+    cv_metrics['train_seconds'] = time.perf_counter() - start
+    model.val_metrics_ = cv_metrics
+    report = {'folds': folds, 'configs': summary, 'best_params': best['config'], 'cv_metrics': cv_metrics}
+    return model, report
 
 
 # ------------------------------
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from services.predictor import predict_many
+from services.similarity import similarity_info
+
+
+class PriceBatcher:
+    """
+    Collects concurrent price requests into micro-batches.
+    A batch is sent when it reaches max_batch_size or when the oldest request
+    has waited max_wait_ms, so the batch is transformed together and
+    model.predict runs once per batch (in a worker thread, off the event loop).
+    With a ModelRegistry, each batch runs on the registry's active versions
+    (per segment), so models can be swapped while the batcher keeps running;
+    a segment whose model fails only fails its own rows, and each result's
+    info carries the registry generation that served it.
+    """
+
+    def __init__(self, model=None, preproc=None, max_batch_size=32, max_wait_ms=5.0, window=2000,
+                 registry=None):
+        self.model = model
+        self.preproc = preproc
+        self.registry = registry
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._worker = None
+        self._latencies_ms = deque(maxlen=window)
+        self._batch_sizes = deque(maxlen=window)
+        self.total_requests = 0
+        self.total_batches = 0
+
+    async def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def predict(self, row: dict):
+        """Queue one row; resolves to (price or None, similarity info dict)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((row, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            rows = pd.DataFrame([row for row, _, _ in batch])
+            errors = {}
+            try:
+                if self.registry is not None:
+                    prices, info, errors = await loop.run_in_executor(None, self.registry.predict_by_segment, rows)
+                else:
+                    prices, info = await loop.run_in_executor(
+                        None, predict_many, self.model, rows, self.preproc
+                    )
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for i, (_, future, queued_at) in enumerate(batch):
+                self._latencies_ms.append((done - queued_at) * 1000)
+                if future.done():
+                    continue
+                if i in errors:
+                    future.set_exception(errors[i])
+                    continue
+                price = None if np.isnan(prices[i]) else float(prices[i])
+                row_info = similarity_info(info['max_cat_matches'].iat[i], info['max_text_similarity'].iat[i])
+                row_info['is_similar'] = bool(info['is_similar'].iat[i])
+                if 'generation' in info:
+                    row_info['generation'] = int(info['generation'].iat[i])
+                future.set_result((price, row_info))
+            self._batch_sizes.append(len(batch))
+            self.total_requests += len(batch)
+            self.total_batches += 1
+
+    def stats(self) -> dict:
+        lat = np.asarray(self._latencies_ms) if self._latencies_ms else np.zeros(1)
+        sizes = np.asarray(self._batch_sizes) if self._batch_sizes else np.zeros(1)
+        return {
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p99_ms": float(np.percentile(lat, 99)),
+            "mean_batch_size": float(sizes.mean()),
+            "max_batch_size_seen": int(sizes.max()),
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "queue_depth": self._queue.qsize(),
+        }
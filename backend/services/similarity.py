@@ -1,24 +1,134 @@
 # similarity.py
+import copy
+import uuid
+import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
 from services.preprocessing import transform_with_preprocessor
+from services.similarity_index import SimilarityIndex, CategoryIndex
 from services.config import MIN_CATEGORY_MATCHES, SIMILARITY_THRESHOLD
 
+def _category_codes(cat_df, preproc):
+    # integer codes in cat_maps order, so training and input rows compare on ints
+    codes = []
+    for c in preproc['cat_cols']:
+        col, allowed = cat_df[c], preproc['cat_maps'][c]
+        if isinstance(col.dtype, pd.CategoricalDtype) and col.cat.categories.equals(pd.Index(allowed)):
+            # transform_with_preprocessor output is already coded this way
+            codes.append(col.cat.codes.to_numpy())
+        else:
+            codes.append(pd.Categorical(col.astype(object), categories=allowed).codes)
+    return np.column_stack(codes)
+
+def get_similarity_index(preproc):
+    # preprocessors pickled before the index existed get one built on first use
+    if preproc.get('sim_index') is None:
+        preproc['sim_index'] = SimilarityIndex(preproc['X_svd_array'])
+    return preproc['sim_index']
+
+def get_category_index(preproc):
+    if preproc.get('cat_index') is None:
+        codes = _category_codes(preproc['X_full_df'], preproc)
+        preproc['cat_index'] = CategoryIndex(
+            codes, [len(preproc['cat_maps'][c]) for c in preproc['cat_cols']]
+        )
+    return preproc['cat_index']
+
+def extend_gate(preproc, X_new_full, X_new_svd, X_new_tfidf=None):
+    """Copy of ``preproc`` whose similarity gate also covers the given transformed rows.
+
+    The indexes are extended (the live preproc is left untouched) and, when
+    present, the training frames get the rows appended as well. The copy
+    has a new version, so cached gate decisions are not reused.
+    """
+    preproc = dict(preproc)
+    sim_index = copy.copy(get_similarity_index(preproc))
+    cat_index = copy.copy(get_category_index(preproc))
+    preproc['sim_index'] = sim_index.extend(np.asarray(X_new_svd))
+    preproc['cat_index'] = cat_index.extend(_category_codes(X_new_full, preproc))
+    if preproc.get('X_svd_array') is not None:
+        preproc['X_svd_array'] = np.concatenate(
+            [preproc['X_svd_array'], np.asarray(X_new_svd, dtype=preproc['X_svd_array'].dtype)])
+    if preproc.get('X_full_df') is not None:
+        X_full = pd.concat([preproc['X_full_df'], X_new_full], ignore_index=True)
+        for c in preproc['cat_cols']:
+            # present categories, sorted, like fit_preprocessor's frame
+            X_full[c] = X_full[c].astype(object).astype('category')
+        preproc['X_full_df'] = X_full
+    if preproc.get('X_tfidf_matrix') is not None:
+        if X_new_tfidf is None:
+            preproc.pop('X_tfidf_matrix')  # would no longer line up with the other frames
+        else:
+            preproc['X_tfidf_matrix'] = sp.vstack([preproc['X_tfidf_matrix'], X_new_tfidf]).tocsr()
+    preproc['version'] = uuid.uuid4().hex
+    return preproc
+
+def find_similarity_for_batch(X_in_full, X_in_svd, preproc,
+                              min_cat_matches=MIN_CATEGORY_MATCHES,
+                              text_threshold=SIMILARITY_THRESHOLD):
+    """Similarity gate for already-transformed rows.
+
+    Returns (is_similar, max_cat_matches, max_text_similarity) as arrays
+    with one entry per input row. Rows that already pass on categories
+    skip the text check; their max_text_similarity is NaN.
+    """
+    in_codes = _category_codes(X_in_full, preproc)
+    max_cat_matches = get_category_index(preproc).max_matches_many(in_codes)
+
+    max_text_sim = np.full(len(X_in_full), np.nan)
+    need_text = max_cat_matches < min_cat_matches
+    if need_text.any():
+        max_text_sim[need_text] = get_similarity_index(preproc).max_sim(
+            np.asarray(X_in_svd)[need_text]
+        )
+
+    is_similar = (max_cat_matches >= min_cat_matches) | (max_text_sim >= text_threshold)
+    return is_similar, max_cat_matches, max_text_sim
+
 def find_similarity_for_input(input_row, preproc,
                               min_cat_matches=MIN_CATEGORY_MATCHES,
                               text_threshold=SIMILARITY_THRESHOLD):
     df_in = pd.DataFrame([input_row])
     X_in_full, _, X_in_svd = transform_with_preprocessor(df_in, preproc)
 
-    train_cat_df = preproc['X_full_df'][preproc['cat_cols']].reset_index(drop=True)
-    in_cat_values = X_in_full[preproc['cat_cols']].iloc[0]
+    is_similar, max_cat, max_sim = find_similarity_for_batch(
+        X_in_full, X_in_svd, preproc, min_cat_matches, text_threshold
+    )
+    return bool(is_similar[0]), similarity_info(max_cat[0], max_sim[0])
+
+def similarity_info(max_cat_matches, max_text_similarity):
+    # text similarity is None when the category check alone passed the gate
+    return {"max_cat_matches": int(max_cat_matches),
+            "max_text_similarity": None if np.isnan(max_text_similarity) else float(max_text_similarity)}
+
+def text_gate_agreement(preproc, rows, text_threshold=SIMILARITY_THRESHOLD, block_size=256):
+    """How closely the similarity index reproduces exact float64 text similarity.
+
+    Each training row in ``rows`` (positions, e.g. the validation split) is
+    queried against the index with its own entry excluded, and compared
+    with its nearest other row under exact float64 cosine similarity.
+    Returns the fraction of rows whose text-gate decision agrees and the
+    largest absolute difference in max similarity; this captures both
+    reduced precision and approximate (ivf) search.
+    """
+    rows = np.asarray(rows)
+    X = np.asarray(preproc['X_svd_array'], dtype=np.float64)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    X = X / norms
 
-    matches = (train_cat_df == in_cat_values.values).sum(axis=1)
-    max_cat_matches = int(matches.max())
+    index = get_similarity_index(preproc)
+    scores, ids = index.top_k(X[rows], 2)
+    # best neighbour that is not the query row itself
+    approx = np.where(ids[:, 0] == rows, scores[:, 1], scores[:, 0]).astype(np.float64)
 
-    train_svd = preproc['X_svd_array']
-    sim_scores = cosine_similarity(X_in_svd, train_svd).flatten()
-    max_text_sim = float(sim_scores.max()) if sim_scores.size else 0.0
+    exact = np.empty(len(rows))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        S = X[block] @ X.T
+        S[np.arange(len(block)), block] = -np.inf
+        exact[start:start + len(block)] = S.max(axis=1)
 
-    is_similar = (max_cat_matches >= min_cat_matches) or (max_text_sim >= text_threshold)
-    return is_similar, {"max_cat_matches": max_cat_matches, "max_text_similarity": max_text_sim}
+    agree = (approx >= text_threshold) == (exact >= text_threshold)
+    return {'text_gate_agreement': float(agree.mean()) if len(rows) else 1.0,
+            'text_sim_max_abs_err': float(np.abs(approx - exact).max()) if len(rows) else 0.0}
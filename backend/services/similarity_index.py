@@ -0,0 +1,295 @@
+# similarity_index.py
+from itertools import combinations
+import numpy as np
+from services.config import RANDOM_STATE
+
+# upper bound on the number of (query x reference) scores held at once
+_MAX_BLOCK_SCORES = 1 << 24
+# stored rows scored (and, for int8, dequantized) at a time by exact queries
+_REF_CHUNK = 1 << 16
+
+def _normalize_rows(X):
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return X / norms
+
+def _quantize_rows(X):
+    # symmetric per-row int8 quantization: X ~= q * scale[:, None]
+    scales = np.abs(X).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(X / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+class SimilarityIndex:
+    """Cosine-similarity index over the training SVD vectors.
+
+    Vectors are L2-normalized and stored as float32 once, at fit time, so a
+    query is a single matmul against the stored matrix. ``mode='ivf'``
+    clusters the vectors into ``n_lists`` buckets and only scores the
+    ``n_probe`` buckets closest to each query; raising ``n_probe`` trades
+    latency for recall (``n_probe >= n_lists`` is exact).
+
+    ``precision='int8'`` stores the vectors scalar-quantized, one float32
+    scale per vector (a quarter of the float32 memory); scores are
+    computed with float32 queries against one chunk of dequantized rows at
+    a time, so a float32 copy of the whole matrix is never built.
+    """
+
+    # indexes pickled before quantization existed are float32
+    precision = 'float32'
+    scales = None
+
+    def __init__(self, vectors, mode='exact', n_lists=None, n_probe=8,
+                 random_state=RANDOM_STATE, precision='float32'):
+        if mode not in ('exact', 'ivf'):
+            raise ValueError(f"Unknown similarity index mode: {mode}")
+        if precision not in ('float32', 'int8'):
+            raise ValueError(f"Unknown similarity index precision: {precision}")
+        self.vectors = _normalize_rows(vectors)
+        self.mode = mode
+        self.n_probe = n_probe
+        self.precision = precision
+        self.centroids = None
+        self.list_offsets = None
+        self.list_rows = None
+        if mode == 'ivf' and len(self.vectors):
+            if n_lists is None:
+                n_lists = max(1, int(np.sqrt(len(self.vectors))))
+            self._build_ivf(min(n_lists, len(self.vectors)), random_state)
+        if precision == 'int8':
+            self.vectors, self.scales = _quantize_rows(self.vectors)
+
+    @classmethod
+    def from_arrays(cls, vectors, mode='exact', n_probe=8,
+                    centroids=None, list_rows=None, list_offsets=None, scales=None):
+        """Rebuild an index from stored arrays (possibly read-only memmaps)."""
+        index = cls.__new__(cls)
+        index.vectors = vectors
+        index.mode = mode
+        index.n_probe = n_probe
+        index.precision = 'float32' if scales is None else 'int8'
+        index.scales = scales
+        index.centroids = centroids
+        index.list_rows = list_rows
+        index.list_offsets = list_offsets
+        return index
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def extend(self, vectors):
+        """Add rows (e.g. newly trained listings) without refitting the IVF centroids.
+
+        New rows are normalized/quantized like the stored ones and, for an
+        ivf index, assigned to their closest existing list.
+        """
+        new = _normalize_rows(vectors)
+        n_old = len(self)
+        if self.centroids is not None and len(new):
+            old_assign = np.empty(n_old, dtype=np.int64)
+            old_assign[self.list_rows] = np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets))
+            new_assign = np.concatenate([
+                (block @ self.centroids.T).argmax(axis=1) for block in self._blocks(new, len(self.centroids))
+            ])
+            assign = np.concatenate([old_assign, new_assign])
+            self.list_rows = np.argsort(assign, kind='stable').astype(np.int64)
+            self.list_offsets = np.concatenate(
+                [[0], np.cumsum(np.bincount(assign, minlength=len(self.centroids)))]
+            ).astype(np.int64)
+        if self.scales is not None:
+            q, scales = _quantize_rows(new)
+            self.vectors = np.concatenate([self.vectors, q])
+            self.scales = np.concatenate([self.scales, scales])
+        else:
+            self.vectors = np.concatenate([np.asarray(self.vectors, dtype=np.float32), new])
+        return self
+
+    @property
+    def _approximate(self):
+        return self.centroids is not None and self.n_probe < len(self.centroids)
+
+    def _build_ivf(self, n_lists, random_state, n_iter=10):
+        # spherical k-means on a sample, then assign every vector to its list
+        rng = np.random.RandomState(random_state)
+        n = len(self.vectors)
+        sample = self.vectors[rng.choice(n, size=min(n, 64 * n_lists), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)]
+        for _ in range(n_iter):
+            assign = (sample @ centroids.T).argmax(axis=1)
+            for j in range(n_lists):
+                members = sample[assign == j]
+                if len(members):
+                    centroids[j] = members.sum(axis=0)
+            centroids = _normalize_rows(centroids)
+
+        assign = np.concatenate([
+            (block @ centroids.T).argmax(axis=1) for block in self._blocks(self.vectors, n_lists)
+        ])
+        self.centroids = centroids
+        self.list_rows = np.argsort(assign, kind='stable').astype(np.int64)
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assign, minlength=n_lists))]
+        ).astype(np.int64)
+
+    def _scores(self, Q, rows):
+        # cosine scores of normalized queries against the given stored rows
+        V = self.vectors[rows]
+        if self.scales is None:
+            return Q @ V.T
+        S = Q @ V.astype(np.float32).T
+        S *= self.scales[rows]
+        return S
+
+    def _chunk_scores(self, Q):
+        # (first row, scores) against consecutive chunks of the stored rows
+        for start in range(0, len(self), _REF_CHUNK):
+            yield start, self._scores(Q, slice(start, start + _REF_CHUNK))
+
+    def _blocks(self, Q, n_ref):
+        step = max(1, _MAX_BLOCK_SCORES // max(1, n_ref))
+        for start in range(0, len(Q), step):
+            yield Q[start:start + step]
+
+    def _candidates(self, q_centroid_scores):
+        probe = np.argpartition(-q_centroid_scores, self.n_probe - 1)[:self.n_probe]
+        return np.concatenate([
+            self.list_rows[self.list_offsets[j]:self.list_offsets[j + 1]] for j in probe
+        ])
+
+    def top_k(self, Q, k=1):
+        """Return (scores, row_ids) of the k most similar stored vectors per query.
+
+        Missing neighbours (empty index or too few candidates in the
+        probed lists) are padded with score 0.0 and row id -1.
+        """
+        Q = _normalize_rows(np.atleast_2d(Q))
+        scores = np.zeros((len(Q), k), dtype=np.float32)
+        ids = np.full((len(Q), k), -1, dtype=np.int64)
+        if len(self) == 0 or len(Q) == 0:
+            return scores, ids
+
+        if not self._approximate:
+            kk = min(k, len(self))
+            start = 0
+            for block in self._blocks(Q, min(len(self), _REF_CHUNK)):
+                stop = start + len(block)
+                best_s = best_i = None
+                for first, S in self._chunk_scores(block):
+                    s, i = _top_k_rows(S, min(kk, S.shape[1]))
+                    del S  # free it before the next chunk is scored
+                    i += first
+                    if best_s is not None:
+                        # running top k: merge the chunk's best with the best so far
+                        s, i = np.hstack([best_s, s]), np.hstack([best_i, i])
+                        s, order = _top_k_rows(s, min(kk, s.shape[1]))
+                        i = np.take_along_axis(i, order, axis=1)
+                    best_s, best_i = s, i
+                scores[start:stop, :kk], ids[start:stop, :kk] = best_s, best_i
+                start = stop
+            return scores, ids
+
+        centroid_scores = Q @ self.centroids.T
+        for i, q in enumerate(Q):
+            rows = self._candidates(centroid_scores[i])
+            s = self._scores(q[None, :], rows)[0]
+            kk = min(k, len(rows))
+            if kk == 0:
+                continue
+            best = np.argpartition(-s, kk - 1)[:kk]
+            best = best[np.argsort(-s[best], kind='stable')]
+            scores[i, :kk] = s[best]
+            ids[i, :kk] = rows[best]
+        return scores, ids
+
+    def max_sim(self, Q):
+        """Highest cosine similarity of each query row against the index."""
+        Q = _normalize_rows(np.atleast_2d(Q))
+        if self._approximate:
+            return self.top_k(Q, 1)[0][:, 0]
+        out = np.zeros(len(Q), dtype=np.float32)
+        if len(self) == 0:
+            return out
+        start = 0
+        for block in self._blocks(Q, min(len(self), _REF_CHUNK)):
+            stop = start + len(block)
+            best = np.full(len(block), -np.inf, dtype=np.float32)
+            for _, S in self._chunk_scores(block):
+                np.maximum(best, S.max(axis=1), out=best)
+                del S
+            out[start:stop] = best
+            start = stop
+        return out
+
+def _top_k_rows(S, k):
+    part = np.argpartition(-S, k - 1, axis=1)[:, :k]
+    part_scores = np.take_along_axis(S, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    ids = np.take_along_axis(part, order, axis=1)
+    return np.take_along_axis(part_scores, order, axis=1), ids
+
+class CategoryIndex:
+    """Inverted index over the integer-coded training categories.
+
+    For every (column, category code) it keeps a packed bitset of the
+    training rows holding that value, so "how many categories does the best
+    training row share with this input" is answered by AND-ing a few
+    bitsets instead of comparing the input against every training row.
+    """
+
+    def __init__(self, codes, n_categories):
+        codes = np.asarray(codes)
+        self.n_rows = codes.shape[0]
+        self.bitsets = [
+            np.stack([np.packbits(codes[:, j] == c) for c in range(n_cat)])
+            if n_cat else np.zeros((0, (self.n_rows + 7) // 8), dtype=np.uint8)
+            for j, n_cat in enumerate(n_categories)
+        ]
+
+    @classmethod
+    def from_bitsets(cls, bitsets, n_rows):
+        index = cls.__new__(cls)
+        index.bitsets = list(bitsets)
+        index.n_rows = n_rows
+        return index
+
+    def extend(self, codes):
+        """Add rows coded against the same category lists."""
+        codes = np.asarray(codes)
+        n_rows = self.n_rows + codes.shape[0]
+        self.bitsets = [
+            np.packbits(np.hstack([np.unpackbits(bits, axis=1, count=self.n_rows),
+                                   (codes[:, j][None, :] == np.arange(len(bits))[:, None]).astype(np.uint8)]),
+                        axis=1)
+            for j, bits in enumerate(self.bitsets)
+        ]
+        self.n_rows = n_rows
+        return self
+
+    def max_matches(self, codes):
+        """Largest number of columns any single training row shares with ``codes``.
+
+        Combinations are tried from largest to smallest and each AND chain
+        stops as soon as it runs empty, so the first hit is the answer.
+        """
+        postings = [self.bitsets[j][c] for j, c in enumerate(codes)
+                    if 0 <= c < len(self.bitsets[j]) and self.bitsets[j][c].any()]
+        for k in range(len(postings), 0, -1):
+            for combo in combinations(postings, k):
+                acc = combo[0]
+                for other in combo[1:]:
+                    acc = acc & other
+                    if not acc.any():
+                        break
+                else:
+                    return k
+        return 0
+
+    def max_matches_many(self, codes):
+        """``max_matches`` for each row of a 2-D code array, deduplicating repeats."""
+        codes = np.asarray(codes)
+        if len(codes) == 0:
+            return np.zeros(0, dtype=np.int64)
+        uniq, inverse = np.unique(codes, axis=0, return_inverse=True)
+        best = np.array([self.max_matches(row) for row in uniq], dtype=np.int64)
+        return best[inverse.reshape(-1)]
@@ -0,0 +1,85 @@
+# text_embedder.py
+from collections import Counter
+import numpy as np
+from sklearn.utils import murmurhash3_32
+
+class TextEmbedder:
+    """TF-IDF -> SVD projection of descriptions, fused into one lookup table.
+
+    Row ``j`` of ``table`` is ``idf[j] * svd.components_[:, j]`` (float32),
+    the projected contribution of one occurrence of term ``j``. Embedding a
+    description is: analyze it with the vectorizer's own analyzer, look up
+    the term columns, sum their rows weighted by term frequency and divide
+    by the norm the TF-IDF row would have had. That is exactly
+    ``svd.transform(tfidf.transform(docs))`` up to float32 rounding, without
+    building sparse matrices or going through sklearn input validation, so
+    it is meant for the one-row/small-batch case.
+
+    Works with a fitted ``TfidfVectorizer`` (vocabulary lookup) or a
+    ``HashingTfidfVectorizer`` (murmurhash bucket -> kept column).
+    """
+
+    def __init__(self, tfidf, svd):
+        if hasattr(tfidf, 'vocabulary_'):
+            self.analyzer = tfidf.build_analyzer()
+            self.columns = dict(tfidf.vocabulary_)
+            self.n_buckets = None
+            self.binary = tfidf.binary
+            self.sublinear_tf = tfidf.sublinear_tf
+            self.norm = tfidf.norm
+            idf = tfidf.idf_ if tfidf.use_idf else np.ones(len(self.columns))
+        else:
+            # HashingTfidfVectorizer: raw counts, smoothed idf, l2 norm
+            self.analyzer = tfidf.hasher.build_analyzer()
+            self.columns = {int(b): j for j, b in enumerate(tfidf.columns_)}
+            self.n_buckets = tfidf.n_buckets
+            self.binary = False
+            self.sublinear_tf = False
+            self.norm = 'l2'
+            idf = tfidf.idf_
+        self.idf = np.asarray(idf, dtype=np.float64)
+        components = np.asarray(svd.components_)
+        self.table = np.ascontiguousarray((components * self.idf).T, dtype=np.float32)
+
+    @property
+    def n_components(self):
+        return self.table.shape[1]
+
+    def _bucket(self, token):
+        # same index HashingVectorizer computes for a token (alternate_sign=False)
+        h = murmurhash3_32(token, seed=0, positive=False)
+        if h == -2 ** 31:
+            return (2 ** 31 - (self.n_buckets - 1)) % self.n_buckets
+        return abs(h) % self.n_buckets
+
+    def _term_counts(self, doc):
+        tokens = self.analyzer(doc)
+        if self.n_buckets is not None:
+            tokens = map(self._bucket, tokens)
+        get = self.columns.get
+        counts = Counter(j for j in map(get, tokens) if j is not None)
+        cols = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+        tf = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        return cols, tf
+
+    def transform(self, docs):
+        """(n_docs, n_components) float32 embeddings of an iterable of strings."""
+        docs = list(docs)
+        out = np.zeros((len(docs), self.n_components), dtype=np.float32)
+        for i, doc in enumerate(docs):
+            cols, tf = self._term_counts(doc)
+            if not len(cols):
+                continue
+            if self.binary:
+                tf[:] = 1.0
+            elif self.sublinear_tf:
+                tf = 1.0 + np.log(tf)
+            weights = tf * self.idf[cols]
+            if self.norm == 'l2':
+                scale = np.sqrt(np.dot(weights, weights))
+            elif self.norm == 'l1':
+                scale = np.abs(weights).sum()
+            else:
+                scale = 1.0
+            out[i] = (tf / scale).astype(np.float32) @ self.table[cols]
+        return out
@@ -0,0 +1,253 @@
+import asyncio
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from deep_translator import GoogleTranslator
+
+
+def normalize_text(text: str) -> str:
+    """Cache form of a message: NFC, surrounding whitespace stripped, inner runs collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+class GoogleBackend:
+    """Google Translate via deep_translator. The web endpoint takes one text per request."""
+    max_batch = 1
+
+    def __init__(self):
+        # GoogleTranslator keeps per-request state on the instance, so one per thread and language pair
+        self._local = threading.local()
+
+    def _translator(self, source: str, target: str):
+        cache = self._local.__dict__.setdefault("translators", {})
+        if (source, target) not in cache:
+            cache[(source, target)] = GoogleTranslator(source=source, target=target)
+        return cache[(source, target)]
+
+    def translate_batch(self, texts, source: str, target: str):
+        translator = self._translator(source, target)
+        return [translator.translate(t) or t for t in texts]
+
+
+class StubBackend:
+    """Deterministic local translator for tests and load runs: "[<target>] <text>" after `latency` seconds per call."""
+
+    def __init__(self, latency: float = 0.0, max_batch: int = 32):
+        self.latency = latency
+        self.max_batch = max_batch
+        self.calls = 0
+
+    def translate_batch(self, texts, source: str, target: str):
+        self.calls += 1
+        time.sleep(self.latency)
+        return [f"[{target}] {t}" for t in texts]
+
+
+class PersistentCache:
+    """sqlite table of translations that survives restarts and is shared by workers on one host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "text TEXT NOT NULL, source TEXT NOT NULL, target TEXT NOT NULL, translated TEXT NOT NULL, "
+            "PRIMARY KEY (text, source, target))"
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT translated FROM translations WHERE text = ? AND source = ? AND target = ?", key
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_many(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations (text, source, target, translated) VALUES (?, ?, ?, ?)",
+                [(*key, translated) for key, translated in items],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TranslationService:
+    """
+    Cached, coalesced and batched translation.
+    Texts are keyed on (normalize_text(text), source, target) and looked up in
+    an in-memory LRU, then in the optional sqlite cache. Identical texts that
+    are already being translated wait for that request instead of sending
+    another one. Misses for the same language pair are collected for up to
+    max_wait_ms (or until the backend's max_batch) and sent as one backend
+    call through `run` (e.g. BlockingIO.run). The backend gets the text as
+    written (line breaks and spacing intact); only the key is normalized.
+    Backend errors and timeouts are raised to every caller waiting on the
+    batch; nothing is cached for them. sqlite reads and writes are blocking
+    (the file is shared with other workers) and go through `disk_run`
+    (default: `run`); if one fails the text is treated as a miss.
+    """
+
+    def __init__(self, backend, run, max_size: int = 10_000, db_path: str = None, max_wait_ms: float = 5.0,
+                 disk_run=None):
+        self.backend = backend
+        self.run = run
+        self.disk_run = disk_run or run
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.disk = PersistentCache(db_path) if db_path else None
+        self._lru: "OrderedDict[tuple, str]" = OrderedDict()
+        self._in_flight = {}   # key -> Future shared by everyone asking for it
+        self._pending = {}     # (source, target) -> [(key, text), ...] waiting for the next batch
+        self._flushers = set()
+        self.requests = 0
+        self.lru_hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.disk_errors = 0
+        self.backend_calls = 0
+        self.backend_seconds = 0.0
+
+    def _remember(self, key, translated):
+        self._lru[key] = translated
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    async def translate(self, text: str, target: str, source: str = "auto") -> str:
+        if not text or not target:
+            return ""
+        self.requests += 1
+        key = (normalize_text(text), source, target)
+        if key in self._lru:
+            self.lru_hits += 1
+            self._lru.move_to_end(key)
+            return self._lru[key]
+        if key in self._in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        # registered before the sqlite lookup so identical texts arriving meanwhile wait for it
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        if self.disk is None:
+            self._enqueue(key, text)
+        else:
+            task = asyncio.create_task(self._lookup_disk(key, text))
+            self._flushers.add(task)
+            task.add_done_callback(self._flushers.discard)
+        return await asyncio.shield(future)
+
+    async def _lookup_disk(self, key, text):
+        try:
+            translated = await self.disk_run(self.disk.get, key)
+        except Exception as e:
+            self.disk_errors += 1
+            print(f"Translation cache lookup failed: {e!r}")
+            translated = None
+        if translated is None:
+            self._enqueue(key, text)
+            return
+        self.disk_hits += 1
+        self._remember(key, translated)
+        future = self._in_flight.pop(key)
+        if not future.done():
+            future.set_result(translated)
+
+    def _enqueue(self, key, text):
+        self.misses += 1
+        source, target = key[1], key[2]
+        pending = self._pending.setdefault((source, target), [])
+        pending.append((key, text))
+        if len(pending) == 1:
+            task = asyncio.create_task(self._flush_after_wait((source, target)))
+            self._flushers.add(task)
+            task.add_done_callback(self._flushers.discard)
+        elif len(pending) >= self.backend.max_batch:
+            self._start_batch((source, target))
+
+    async def _flush_after_wait(self, pair):
+        if self.backend.max_batch > 1:
+            await asyncio.sleep(self.max_wait)
+        self._start_batch(pair)
+
+    def _start_batch(self, pair):
+        items = self._pending.pop(pair, [])
+        if items:
+            task = asyncio.create_task(self._translate_batch(pair, items))
+            self._flushers.add(task)
+            task.add_done_callback(self._flushers.discard)
+
+    async def _translate_batch(self, pair, items):
+        source, target = pair
+        keys = [key for key, _ in items]
+        start = time.perf_counter()
+        try:
+            translated = await self.run(self.backend.translate_batch, [text for _, text in items], source, target)
+        except asyncio.CancelledError:
+            for key in keys:
+                future = self._in_flight.pop(key, None)
+                if future is not None:
+                    future.cancel()
+            raise
+        except Exception as e:
+            for key in keys:
+                future = self._in_flight.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception()  # callers may have given up; don't warn about it
+            return
+        self.backend_calls += 1
+        self.backend_seconds += time.perf_counter() - start
+        results = list(zip(keys, translated))
+        for key, text in results:
+            self._remember(key, text)
+            future = self._in_flight.pop(key)
+            if not future.done():
+                future.set_result(text)
+        if self.disk is not None:
+            try:
+                await self.disk_run(self.disk.put_many, results)
+            except Exception as e:
+                self.disk_errors += 1
+                print(f"Translation cache write failed: {e!r}")
+
+    def stats(self) -> dict:
+        hits = self.lru_hits + self.disk_hits + self.coalesced
+        call_seconds = self.backend_seconds / self.backend_calls if self.backend_calls else 0.0
+        return {
+            "requests": self.requests,
+            "lru_hits": self.lru_hits,
+            "disk_hits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "disk_errors": self.disk_errors,
+            "hit_rate": hits / self.requests if self.requests else 0.0,
+            "backend_calls": self.backend_calls,
+            "texts_per_backend_call": round(self.misses / self.backend_calls, 2) if self.backend_calls else 0.0,
+            "backend_call_ms": round(1000 * call_seconds, 1),
+            # each hit would otherwise have waited for (at least) one backend call
+            "latency_saved_s": round(hits * call_seconds, 2),
+            "lru_size": len(self._lru),
+            "in_flight": len(self._in_flight),
+        }
+
+    async def close(self):
+        for task in list(self._flushers):
+            task.cancel()
+        await asyncio.gather(*self._flushers, return_exceptions=True)
+        for future in self._in_flight.values():
+            future.cancel()
+        self._in_flight.clear()
+        self._pending.clear()
+        if self.disk is not None:
+            self.disk.close()
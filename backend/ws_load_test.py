@@ -0,0 +1,354 @@
+"""
+Load test for the chat websocket path (/ws/{user_id}).
+
+Starts app.py in-process with its network dependencies replaced by sleeps
+of realistic latency (Supabase fetch/insert, translation, Gemini), opens
+--pairs buyer/artisan socket pairs and has every buyer send --messages
+messages. Reports recipient delivery latency, database reads, suggestion
+latency (first streamed chunk and complete), cancelled suggestions and the
+server's event-loop lag, e.g.:
+
+    python ws_load_test.py --pairs 100 --messages 5
+    python ws_load_test.py --pairs 100 --messages 5 --workers 4
+    python ws_load_test.py --llm-ms 400 --tokens 40 --token-ms 30 --burst-gap-ms 300
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+
+os.environ.setdefault("SUPABASE_URL", "http://127.0.0.1:9")
+os.environ.setdefault("SUPABASE_KEY", "load-test")
+os.environ.setdefault("GEMINI_API_KEY", "load-test")
+
+import httpx
+import uvicorn
+import websockets
+
+import app as chat_app
+import redis_standin
+from services.broker import RedisBroker
+from services.history_compactor import estimate_tokens
+from services.translation import StubBackend, TranslationService
+
+
+def install_fake_dependencies(db_ms, translate_ms, llm_ms, history=1, row_us=0.0, tokens=20, token_ms=0.0, prompt_us=0.0):
+    """Replace the blocking network calls with sleeps of the given latency.
+
+    Every conversation starts with `history` stored messages; a database read
+    costs db_ms plus row_us per row returned, so full-history fetches get
+    slower as conversations grow.
+    """
+    tables = {}
+    lock = threading.Lock()
+    reads = {"queries": 0, "rows": 0, "inserts": 0, "prompt_tokens": []}
+    seq = itertools.count(1)  # the database's identity column
+
+    def conversation(conversation_id):
+        buyer, artisan = f"buyer-{conversation_id}", f"artisan-{conversation_id}"
+        participants = [
+            {"id": buyer, "role": "buyer", "language_preference": "en"},
+            {"id": artisan, "role": "artisan", "language_preference": "hi"},
+        ]
+        if conversation_id not in tables:
+            tables[conversation_id] = [
+                {"id": f"{conversation_id}-{n}", "sender_id": buyer,
+                 "original_text": f"Message {n}: could you tell me more about the hand-woven saree, its colours and delivery time?",
+                 "created_at": f"2024-01-01T00:00:00.{n:06d}+00:00", "seq": next(seq), "sender": participants[0]}
+                for n in range(history)
+            ]
+        return participants, tables[conversation_id]
+
+    def read(rows):
+        reads["queries"] += 1
+        reads["rows"] += len(rows)
+        time.sleep(db_ms / 1000 + len(rows) * row_us / 1e6)
+        return rows
+
+    def fetch_conversation(conversation_id):
+        with lock:
+            participants, messages = conversation(conversation_id)
+            rows = messages[-chat_app.CHAT_HISTORY_WINDOW:][::-1]
+        return participants, read(rows)
+
+    def fetch_messages_since(conversation_id, since):
+        with lock:
+            rows = [m for m in conversation(conversation_id)[1] if since is None or m["seq"] > since]
+        return read(rows)
+
+    def insert_messages(rows):
+        reads["inserts"] += 1
+        time.sleep(db_ms / 1000 + len(rows) * row_us / 1e6)
+        with lock:
+            for row in rows:
+                participants, messages = conversation(row["conversation_id"])
+                messages.append({**row, "seq": next(seq), "sender": next(p for p in participants if p["id"] == row["sender_id"])})
+
+    def generate_content(prompt, stream=False):
+        # llm_ms plus prompt_us per prompt token until the first token, then one token every token_ms
+        prompt_tokens = estimate_tokens(prompt)
+        reads["prompt_tokens"].append(prompt_tokens)
+        first_token_s = llm_ms / 1000 + prompt_tokens * prompt_us / 1e6
+        words = [f"{w} " for w in ("Thank you for your interest! " * tokens).split()[:tokens]]
+        if not stream:
+            time.sleep(first_token_s + tokens * token_ms / 1000)
+            return types.SimpleNamespace(text="".join(words))
+
+        def chunks():
+            time.sleep(first_token_s)
+            for word in words:
+                yield types.SimpleNamespace(text=word)
+                time.sleep(token_ms / 1000)
+        return chunks()
+
+    chat_app.fetch_conversation = chat_app.conversation_cache.load_fn = fetch_conversation
+    chat_app.fetch_messages_since = chat_app.conversation_cache.delta_fn = fetch_messages_since
+    chat_app.insert_messages = chat_app.message_writer.insert_many = insert_messages
+    # fresh in-memory cache per run so results don't depend on earlier runs
+    chat_app.translation_service = TranslationService(StubBackend(latency=translate_ms / 1000), chat_app.translate_io.run)
+    chat_app.gemini_model = types.SimpleNamespace(generate_content=generate_content)
+    return reads
+
+
+def start_server(port):
+    config = uvicorn.Config(chat_app.app, host="127.0.0.1", port=port, log_level="warning", ws_ping_interval=None)
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+async def loop_lag_probe(stop, lags, interval=0.01):
+    # runs on the server's loop: how late a 10 ms sleep wakes up
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+
+
+COMMON_PHRASES = ["Hello!", "What is the price?", "Is this available?", "Can you ship to Delhi?",
+                  "Thank you", "Can you give a discount?", "What material is it made of?", "Okay, deal."]
+
+
+def message_text(i, n, repeat_ratio):
+    # a share of buyers' messages are stock phrases, the rest are unique to the conversation
+    rng = random.Random(i * 1000 + n)
+    if rng.random() < repeat_ratio:
+        return rng.choice(COMMON_PHRASES)
+    return f"message {n} about listing {i}"
+
+
+async def run_pair(urls, i, args, results):
+    conversation = f"c{i}"
+    # with several workers, buyer and artisan land on different ones
+    buyer_url, artisan_url = urls[i % len(urls)], urls[(i + 1) % len(urls)]
+    # no client keepalive: a blocked server loop would otherwise drop the sockets mid-run
+    async with websockets.connect(f"{buyer_url}/ws/buyer-{conversation}", ping_interval=None) as buyer, \
+            websockets.connect(f"{artisan_url}/ws/artisan-{conversation}", ping_interval=None) as artisan:
+        sent = []
+
+        async def send_all():
+            for n in range(args.messages):
+                sent.append(time.perf_counter())
+                await buyer.send(json.dumps({"conversation_id": conversation, "text": message_text(i, n, args.repeat_ratio)}))
+                if args.burst_gap_ms is None:
+                    await replied.wait()
+                    replied.clear()
+                else:
+                    await asyncio.sleep(args.burst_gap_ms / 1000)
+
+        # waits for one suggestion per message, or in burst mode for the suggestion after the last message
+        replied = asyncio.Event()
+        sender = asyncio.create_task(send_all())
+        delivered = 0
+        first_chunk = False
+        while True:
+            frame = json.loads(await asyncio.wait_for(artisan.recv(), args.timeout))
+            elapsed = (time.perf_counter() - sent[-1]) * 1000
+            kind = frame.get("type")
+            if kind == "message":
+                results["delivery"].append(elapsed)
+                delivered += 1
+                first_chunk = False
+            elif kind == "suggestion_delta" and not first_chunk:
+                results["first_chunk"].append(elapsed)
+                first_chunk = True
+            elif kind == "suggestion_cancelled":
+                results["cancelled"] += 1
+            elif kind == "suggestion":
+                results["suggestion"].append(elapsed)
+                replied.set()
+                if delivered == args.messages:
+                    break
+        await sender
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    v = np.asarray(values)
+    return {"n": len(v), "p50_ms": round(float(np.percentile(v, 50)), 1),
+            "p99_ms": round(float(np.percentile(v, 99)), 1), "max_ms": round(float(v.max()), 1)}
+
+
+def token_percentiles(values):
+    v = np.asarray(values) if values else np.zeros(1)
+    return {"n": len(values), "p50": int(np.percentile(v, 50)), "max": int(v.max())}
+
+
+def new_results():
+    return {"delivery": [], "first_chunk": [], "suggestion": [], "cancelled": 0}
+
+
+def summarize(results):
+    return {"delivery": percentiles(results["delivery"]),
+            "suggestion_first_chunk": percentiles(results["first_chunk"]),
+            "suggestion": percentiles(results["suggestion"]),
+            "suggestions_cancelled": results["cancelled"]}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_worker(port, broker_url):
+    # one of the --workers processes: same fakes, messages routed through the broker
+    chat_app.manager.broker = RedisBroker(broker_url)
+    server, thread = start_server(port)
+    print("ready", flush=True)
+    thread.join()
+
+
+def run_multi_worker(args):
+    standin_port = free_port()
+    standin_loop = asyncio.new_event_loop()
+    threading.Thread(target=standin_loop.run_until_complete,
+                     args=(redis_standin.serve("127.0.0.1", standin_port),), daemon=True).start()
+    broker_url = f"redis://127.0.0.1:{standin_port}/0"
+
+    ports = [free_port() for _ in range(args.workers)]
+    passthrough = ["--db-ms", str(args.db_ms), "--translate-ms", str(args.translate_ms), "--llm-ms", str(args.llm_ms),
+                   "--history", str(args.history), "--row-us", str(args.row_us),
+                   "--tokens", str(args.tokens), "--token-ms", str(args.token_ms), "--prompt-us", str(args.prompt_us)] + (["--no-stream"] if args.no_stream else [])
+    workers = [subprocess.Popen([sys.executable, __file__, "--serve", str(port), "--broker-url", broker_url, *passthrough],
+                                stdout=subprocess.PIPE, text=True) for port in ports]
+    try:
+        for w in workers:
+            while w.stdout.readline().strip() != "ready":
+                pass
+
+        results = new_results()
+
+        async def run_all():
+            urls = [f"ws://127.0.0.1:{port}" for port in ports]
+            await asyncio.gather(*[run_pair(urls, i, args, results) for i in range(args.pairs)])
+
+        start = time.perf_counter()
+        asyncio.run(run_all())
+        wall = time.perf_counter() - start
+        worker_stats = [httpx.get(f"http://127.0.0.1:{port}/ws/stats").json() for port in ports]
+    finally:
+        for w in workers:
+            w.terminate()
+            w.wait(timeout=10)
+
+    report = {
+        "pairs": args.pairs,
+        "messages_per_pair": args.messages,
+        "workers": args.workers,
+        "wall_s": round(wall, 2),
+        **summarize(results),
+        "brokers": [w["broker"] for w in worker_stats],
+    }
+    print(json.dumps(report, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--db-ms", type=float, default=40)
+    parser.add_argument("--translate-ms", type=float, default=150)
+    parser.add_argument("--llm-ms", type=float, default=1500)
+    parser.add_argument("--tokens", type=int, default=20, help="tokens per AI suggestion")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="LLM delay between tokens")
+    parser.add_argument("--prompt-us", type=float, default=0.0, help="extra LLM latency per prompt token, microseconds")
+    parser.add_argument("--no-stream", action="store_true", help="send suggestions as one frame")
+    parser.add_argument("--burst-gap-ms", type=float,
+                        help="send each buyer's messages this far apart instead of waiting for suggestions")
+    parser.add_argument("--history", type=int, default=1, help="stored messages per conversation at start")
+    parser.add_argument("--repeat-ratio", type=float, default=0.5, help="share of messages that are stock phrases")
+    parser.add_argument("--row-us", type=float, default=0.0, help="database cost per row read, microseconds")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="server processes; >1 routes through RedisBroker on a local redis_standin")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--broker-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    reads = install_fake_dependencies(args.db_ms, args.translate_ms, args.llm_ms, args.history, args.row_us,
+                                      args.tokens, args.token_ms, args.prompt_us)
+    if args.no_stream:
+        chat_app.AI_STREAM_SUGGESTIONS = False
+    if args.serve:
+        serve_worker(args.serve, args.broker_url)
+        return
+    if args.workers > 1:
+        run_multi_worker(args)
+        return
+
+    # the lag probe has to run on the server's own loop
+    lags, stop = [], threading.Event()
+
+    async def start_probe():
+        asyncio.create_task(loop_lag_probe(stop, lags))
+    chat_app.app.router.on_startup.append(start_probe)
+
+    port = free_port()
+    server, thread = start_server(port)
+
+    results = new_results()
+
+    async def run_all():
+        await asyncio.gather(*[run_pair([f"ws://127.0.0.1:{port}"], i, args, results) for i in range(args.pairs)])
+
+    start = time.perf_counter()
+    asyncio.run(run_all())
+    wall = time.perf_counter() - start
+    stop.set()
+    server.should_exit = True
+    thread.join(timeout=5)
+
+    report = {
+        "pairs": args.pairs,
+        "messages_per_pair": args.messages,
+        "wall_s": round(wall, 2),
+        **summarize(results),
+        "server_loop_lag": percentiles(lags),
+        "send_queues": chat_app.manager.stats(),
+        "prompt_tokens": token_percentiles(reads.pop("prompt_tokens")),
+        "db_reads": reads,
+        "history": chat_app.history_compactor.stats(),
+        "conversation_cache": chat_app.conversation_cache.stats(),
+        "translation": chat_app.translation_service.stats(),
+        "message_writer": chat_app.message_writer.stats(),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# benchmark.py
+# Timing / memory benchmark for the price pipeline:
+#   load_dataset -> fit_preprocessor -> train_model -> predict (single row and batch)
+#
+#   python benchmark.py --rows 1000 10000 100000 --output bench.json
+#   python benchmark.py --rows 10000 --baseline bench.json   # exit code 1 on regression
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import model_utils
+from config import REQUIRED_COLS, RANDOM_STATE
+from data_utils import load_dataset
+from preprocessing import fit_preprocessor
+from model_utils import train_model
+from predictor import predict_many, predict_with_similarity_check
+
+# realistic vocabularies; frequencies are Zipf-like so rare-category bucketing kicks in
+VOCAB = {
+    'product_type': ['shawl', 'pottery', 'painting', 'textile', 'jewelry', 'craft', 'decor',
+                     'sculpture', 'furniture', 'basketry', 'toy'],
+    'material': ['wool', 'clay', 'wood', 'cloth', 'cotton', 'silk', 'brass', 'bamboo', 'jute',
+                 'stone', 'silver', 'terracotta', 'paper', 'beads', 'metal', 'lac', 'coir'],
+    'color': ['red', 'white', 'brown', 'dark brown', 'golden', 'multicolor', 'blue', 'green',
+              'black', 'yellow', 'natural'],
+    'style': ['pashmina', 'madhubani', 'warli', 'kantha', 'bidriware', 'dokra', 'phulkari',
+              'ikat', 'banarasi', 'kanjivaram', 'tribal', 'wood carving', 'pattachitra',
+              'gond', 'blue pottery', 'channapatna toys', 'stone carving', 'miniature'],
+    'region': ['kashmir', 'rajasthan', 'odisha', 'west bengal', 'karnataka', 'gujarat', 'bihar',
+               'uttar pradesh', 'tamil nadu', 'kerala', 'assam', 'punjab', 'maharashtra',
+               'madhya pradesh', 'manipur', 'nagaland', 'telangana'],
+}
+ADJECTIVES = ['traditional', 'handcrafted', 'intricate', 'vibrant', 'elegant', 'rustic',
+              'handwoven', 'hand-painted', 'authentic', 'ornate', 'minimal', 'festive']
+DETAILS = ['with intricate detailing', 'made by local artisans', 'using natural dyes',
+           'with mirror work', 'perfect for gifting', 'inspired by temple art',
+           'finished with gold leaf', 'for home decor', 'with floral motifs']
+
+def make_synthetic_dataset(n_rows, random_state=RANDOM_STATE):
+    """Synthetic artisan products with the REQUIRED_COLS schema."""
+    rng = np.random.RandomState(random_state)
+    data = {}
+    for col, values in VOCAB.items():
+        weights = 1.0 / np.arange(1, len(values) + 1)
+        codes = rng.choice(len(values), size=n_rows, p=weights / weights.sum())
+        data[col] = np.asarray(values, dtype=object)[codes]
+        # a sprinkle of one-off values, like hand-typed listings
+        rare = rng.rand(n_rows) < 0.01
+        data[col][rare] = [f"{col}_{i}" for i in rng.randint(0, 10 * n_rows, rare.sum())]
+
+    adj = np.asarray(ADJECTIVES, dtype=object)[rng.randint(0, len(ADJECTIVES), n_rows)]
+    det = np.asarray(DETAILS, dtype=object)[rng.randint(0, len(DETAILS), n_rows)]
+    data['description'] = (pd.Series(adj).str.capitalize() + ' ' + data['region'] + ' '
+                           + data['style'] + ' ' + data['product_type'] + ' ' + det).values
+
+    base = pd.Series(data['product_type']).map(
+        {v: 500 * (i + 1) for i, v in enumerate(VOCAB['product_type'])}).fillna(1000).values
+    data['price'] = np.round(base * rng.lognormal(0.0, 0.4, n_rows)).astype(int)
+    return pd.DataFrame(data)[REQUIRED_COLS]
+
+
+class _PeakRss:
+    # samples /proc/self/statm in a thread; ru_maxrss only ever grows, so it
+    # cannot attribute peaks to a single stage
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._page = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def _rss(self):
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * self._page
+        except OSError:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+@contextmanager
+def _stage(results, name):
+    with _PeakRss() as rss:
+        start = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - start
+    results[name] = {'seconds': seconds, 'peak_rss_mb': rss.peak / 2 ** 20}
+    print(f"  {name:<22} {seconds:9.3f} s   peak RSS {rss.peak / 2 ** 20:8.1f} MB")
+
+def _latency_ms(samples):
+    samples = np.asarray(samples) * 1000
+    return {'p50_ms': float(np.percentile(samples, 50)),
+            'p99_ms': float(np.percentile(samples, 99)),
+            'mean_ms': float(samples.mean())}
+
+def run_benchmark(n_rows, n_estimators=200, n_single=200, batch_size=1000, workdir=None):
+    """Run every pipeline stage on `n_rows` synthetic rows; returns a results dict."""
+    print(f"\n== {n_rows} rows ==")
+    stages = {}
+    workdir = workdir or tempfile.mkdtemp(prefix="price_bench_")
+    path = os.path.join(workdir, f"bench_{n_rows}.csv")
+    make_synthetic_dataset(n_rows).to_csv(path, index=False)
+    cache_dir = os.path.join(workdir, "cache")
+
+    with _stage(stages, 'load_dataset'):
+        df = load_dataset(path, use_cache=False)
+    with _stage(stages, 'build_dataset_cache'):
+        load_dataset(path, cache_dir=cache_dir)
+    with _stage(stages, 'load_dataset_cached'):
+        load_dataset(path, cache_dir=cache_dir)
+
+    with _stage(stages, 'fit_preprocessor'):
+        preproc = fit_preprocessor(df)
+
+    # cap boosting rounds so large scales finish; early stopping still applies
+    saved = dict(model_utils.MODEL_PARAMS)
+    model_utils.MODEL_PARAMS.update(n_estimators=n_estimators, verbose=-1)
+    try:
+        with _stage(stages, 'train_model'):
+            model, metrics = train_model(preproc['X_full_df'], df['price'].astype(float), preproc['cat_cols'],
+                                         cache_dir=os.path.join(workdir, "lgb_cache"))
+    finally:
+        model_utils.MODEL_PARAMS.clear()
+        model_utils.MODEL_PARAMS.update(saved)
+
+    rows = df.drop(columns=['price']).sample(min(len(df), max(n_single, batch_size)),
+                                             random_state=RANDOM_STATE, replace=len(df) < batch_size)
+    single = []
+    for row in rows.head(n_single).to_dict('records'):
+        start = time.perf_counter()
+        try:
+            predict_with_similarity_check(model, row, preproc)
+        except ValueError:
+            pass
+        single.append(time.perf_counter() - start)
+
+    batch = rows.head(batch_size)
+    with _stage(stages, 'predict_many'):
+        predict_many(model, batch, preproc)
+    per_row = stages['predict_many']['seconds'] / len(batch)
+    single_ms = _latency_ms(single)
+    print(f"  single-row predict     p50 {single_ms['p50_ms']:.2f} ms   p99 {single_ms['p99_ms']:.2f} ms")
+    print(f"  batch predict          {per_row * 1000:.3f} ms/row (batch of {len(batch)})")
+
+    return {
+        'n_rows': n_rows,
+        'stages': stages,
+        'predict': {
+            'single_row': single_ms,
+            'batch': {'batch_size': len(batch), 'per_row_ms': per_row * 1000,
+                      'total_ms': stages['predict_many']['seconds'] * 1000},
+        },
+        'metrics': {k: float(v) for k, v in metrics.items()},
+    }
+
+def compare_to_baseline(results, baseline, tolerance=0.2, min_seconds=0.05):
+    """List of regressions: stage metrics more than `tolerance` worse than the baseline.
+
+    Stages faster than `min_seconds` in both runs are ignored for time, since
+    their timing is mostly noise.
+    """
+    regressions = []
+    base_by_rows = {r['n_rows']: r for r in baseline['runs']}
+    for run in results['runs']:
+        base = base_by_rows.get(run['n_rows'])
+        if base is None:
+            continue
+        checks = [(f"{name}.{metric}", value, base['stages'].get(name, {}).get(metric))
+                  for name, stage in run['stages'].items() for metric, value in stage.items()]
+        checks.append(('predict.single_row.p50_ms', run['predict']['single_row']['p50_ms'],
+                       base['predict']['single_row']['p50_ms']))
+        checks.append(('predict.batch.per_row_ms', run['predict']['batch']['per_row_ms'],
+                       base['predict']['batch']['per_row_ms']))
+        for name, value, ref in checks:
+            if ref is None:
+                continue
+            if name.endswith('.seconds') and max(value, ref) < min_seconds:
+                continue
+            if value > ref * (1 + tolerance):
+                regressions.append({'n_rows': run['n_rows'], 'metric': name,
+                                    'baseline': ref, 'current': value,
+                                    'change': value / ref - 1 if ref else float('inf')})
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the price prediction pipeline.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="dataset sizes to run (1k .. 1M)")
+    parser.add_argument('--n-estimators', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--single', type=int, default=200, help="single-row predictions to time")
+    parser.add_argument('--output', help="write JSON results here")
+    parser.add_argument('--baseline', help="JSON results to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="relative slowdown / memory growth counted as a regression")
+    args = parser.parse_args(argv)
+
+    import lightgbm, sklearn
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'versions': {'numpy': np.__version__, 'pandas': pd.__version__,
+                         'scikit-learn': sklearn.__version__, 'lightgbm': lightgbm.__version__},
+        },
+        'runs': [run_benchmark(n, args.n_estimators, args.single, args.batch_size) for n in args.rows],
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION [{r['n_rows']} rows] {r['metric']}: "
+                  f"{r['baseline']:.4g} -> {r['current']:.4g} ({r['change']:+.0%})")
+        if regressions:
+            return 1
+        print("✅ No regressions against baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
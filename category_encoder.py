@@ -0,0 +1,90 @@
+# category_encoder.py
+import numpy as np
+import pandas as pd
+from config import CARDINALITY_MIN_FREQ
+
+OTHER = '__other__'
+
+def _code_dtype(n_categories):
+    if n_categories <= np.iinfo(np.int8).max:
+        return np.int8
+    if n_categories <= np.iinfo(np.int16).max:
+        return np.int16
+    return np.int32
+
+class CategoryEncoder:
+    """Rare-category bucketing for the categorical feature columns.
+
+    Each column keeps its allowed values (the ``cat_maps`` lists) as a
+    hashed ``pd.Index``, so a whole column is mapped to small integer codes
+    with one vectorized lookup. Anything outside the vocabulary gets the
+    reserved ``__other__`` code. Mapping rules match the original
+    ``fit_preprocessor`` / ``transform_with_preprocessor`` code exactly:
+    at fit time only values already in the vocabulary survive (missing
+    values become ``__other__``); at transform time values are first
+    filled with ``'unknown'`` and cast to ``str``.
+    """
+
+    def __init__(self, cat_cols, min_freq=CARDINALITY_MIN_FREQ):
+        self.cat_cols = list(cat_cols)
+        self.min_freq = min_freq
+        self.vocab = {}
+
+    @classmethod
+    def from_cat_maps(cls, cat_cols, cat_maps):
+        enc = cls(cat_cols)
+        enc.vocab = {c: pd.Index(cat_maps[c], dtype=object) for c in enc.cat_cols}
+        return enc
+
+    @property
+    def cat_maps(self):
+        return {c: self.vocab[c].tolist() for c in self.cat_cols}
+
+    @staticmethod
+    def value_counts(series):
+        # object dtype keeps value_counts ordering (and so cat_maps) identical for category input
+        return series.astype(object).fillna('unknown').astype(str).value_counts()
+
+    def fit(self, df):
+        return self.fit_counts({c: self.value_counts(df[c]) for c in self.cat_cols})
+
+    def fit_counts(self, counts):
+        """Build the vocabularies from per-column value counts (e.g. summed over chunks)."""
+        for c in self.cat_cols:
+            vc = counts[c]
+            allowed = vc[vc >= self.min_freq].index.tolist()
+            if OTHER not in allowed:
+                allowed.append(OTHER)
+            self.vocab[c] = pd.Index(allowed, dtype=object)
+        return self
+
+    def encode(self, series, c, fit=False):
+        """Map one column to integer codes into ``cat_maps[c]``."""
+        vocab = self.vocab[c]
+
+        # look up the (few) distinct values once, then gather by code
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            value_codes, uniques = series.cat.codes.to_numpy(), series.cat.categories.astype(object)
+        else:
+            value_codes, uniques = pd.factorize(series)
+            uniques = pd.Index(uniques, dtype=object)
+            if pd.api.types.infer_dtype(uniques, skipna=False) not in ('string', 'empty'):
+                # factorize merges 1 / 1.0 / True, which str() would tell apart
+                values = series if fit else series.fillna('unknown').astype(str)
+                return self._finish(vocab.get_indexer(values), vocab)
+
+        lookup = vocab.get_indexer(uniques if fit else uniques.astype(str))
+        missing = -1 if fit else vocab.get_indexer(['unknown'])[0]
+        return self._finish(np.append(lookup, missing)[value_codes], vocab)
+
+    @staticmethod
+    def _finish(codes, vocab):
+        codes[codes < 0] = vocab.get_loc(OTHER)
+        return codes.astype(_code_dtype(len(vocab)))
+
+    def transform(self, df, fit=False):
+        """Return the categorical columns as pandas categoricals, ready for LightGBM."""
+        return pd.DataFrame({
+            c: pd.Categorical.from_codes(self.encode(df[c], c, fit), categories=self.vocab[c])
+            for c in self.cat_cols
+        }, index=df.index)
@@ -1,9 +1,19 @@
 # data_utils.py
 import os
+import json
+import hashlib
 import pandas as pd
-from config import DATA_PATH, REQUIRED_COLS
+from config import DATA_PATH, REQUIRED_COLS, STREAMING_CHUNK_SIZE, DATA_CACHE_DIR
 
-def load_dataset(path=DATA_PATH):
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:   # cache is optional; without pyarrow every load parses the source
+    pa = None
+
+CAT_COLS = ['product_type', 'material', 'color', 'style', 'region']
+
+def _read_source(path):
     # 1. Check if file exists
     if not os.path.exists(path):
         raise FileNotFoundError(f"Data file not found at: {path}")
@@ -24,3 +34,135 @@ def load_dataset(path=DATA_PATH):
 
     # 4. Return only required columns, in the expected order
     return df[REQUIRED_COLS].copy()
+
+def _check_columns(columns):
+    columns = list(columns) if columns is not None else REQUIRED_COLS
+    unknown = [c for c in columns if c not in REQUIRED_COLS]
+    if unknown:
+        raise ValueError(f"Unknown columns requested: {unknown}")
+    return columns
+
+def load_dataset(path=DATA_PATH, columns=None, use_cache=True, cache_dir=DATA_CACHE_DIR):
+    columns = _check_columns(columns)
+    cache_path = _cached_table(path, cache_dir) if use_cache else None
+    if cache_path is None:
+        return _read_source(path)[columns]
+    table = feather.read_table(cache_path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+def iter_dataset(path=DATA_PATH, chunksize=STREAMING_CHUNK_SIZE, columns=None,
+                 use_cache=True, cache_dir=DATA_CACHE_DIR):
+    # Same validation and column order as load_dataset, but yields DataFrames
+    # of at most `chunksize` rows without holding the whole file in memory.
+    columns = _check_columns(columns)
+    cache_path = _cached_table(path, cache_dir) if use_cache else None
+    if cache_path is not None:
+        # batches are zero-copy slices of the memory-mapped cache file
+        table = feather.read_table(cache_path, columns=columns, memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
+        return
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Data file not found at: {path}")
+
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        chunks = pd.read_csv(path, chunksize=chunksize)
+    elif ext == ".xlsx":
+        chunks = _iter_xlsx(path, chunksize)
+    elif ext == ".xls":
+        # xlrd has no streaming reader; fall back to slicing the loaded sheet
+        df = pd.read_excel(path)
+        chunks = (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+    else:
+        raise ValueError(f"Unsupported file format: {ext}. Use .csv, .xlsx, or .xls")
+
+    for chunk in chunks:
+        missing = [c for c in REQUIRED_COLS if c not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {missing}")
+        yield chunk[columns].reset_index(drop=True)
+
+def _iter_xlsx(path, chunksize):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = list(next(rows, ()))
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == chunksize:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch or not header:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        wb.close()
+
+
+# ------------------------------
+# Columnar (Arrow IPC / Feather) cache of the parsed source
+# ------------------------------
+def _file_hash(path, block_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _cached_table(path, cache_dir=DATA_CACHE_DIR):
+    """Return the cache file for `path`, converting the source on first use.
+
+    Entries are keyed by source path, size and mtime; a changed stat only
+    costs a content hash, and an unchanged hash reuses the existing file.
+    Returns None when pyarrow is missing or the data cannot be stored.
+    """
+    if pa is None:
+        return None
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Data file not found at: {path}")
+
+    content_hash = dataset_hash(path, cache_dir)
+    cache_path = os.path.join(cache_dir, f"{content_hash}.arrow")
+    if not os.path.exists(cache_path):
+        df = _read_source(path)
+        for c in CAT_COLS:
+            df[c] = df[c].astype('category')
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            print(f"Dataset cache skipped for {path}: {e}")
+            return None
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        feather.write_feather(table, tmp_path, compression='uncompressed',
+                              chunksize=STREAMING_CHUNK_SIZE)
+        os.replace(tmp_path, cache_path)
+    return cache_path
+
+def dataset_hash(path=DATA_PATH, cache_dir=DATA_CACHE_DIR):
+    """sha256 of the source file, remembered in the cache index by size and mtime."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Data file not found at: {path}")
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "index.json")
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (FileNotFoundError, ValueError):
+        index = {}
+
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+        return entry['sha256']
+
+    content_hash = _file_hash(path)
+    index[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': content_hash}
+    tmp_index = f"{index_path}.tmp-{os.getpid()}"
+    with open(tmp_index, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_index, index_path)
+    return content_hash
@@ -0,0 +1,45 @@
+# pipeline_cache.py
+# Content-addressed cache of pipeline stage outputs (see main.run_pipeline).
+#
+#   <cache_dir>/<stage>-<key>.joblib
+#
+# A stage's key hashes everything its output depends on: the keys of the
+# stages it consumes, the config values it reads and the source of the
+# modules that compute it. Changing any of them gives a new key, so stale
+# entries are never read; they are only left behind on disk.
+import os
+import json
+import hashlib
+import joblib
+from config import PIPELINE_CACHE_DIR
+
+_MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def code_version(*modules):
+    """sha256 over the source files of the given pipeline modules (by module name)."""
+    h = hashlib.sha256()
+    for name in sorted(modules):
+        with open(os.path.join(_MODULE_DIR, f"{name}.py"), "rb") as f:
+            h.update(name.encode())
+            h.update(f.read())
+    return h.hexdigest()
+
+def stage_key(**parts):
+    """Stable hash of JSON-serializable key parts (tuples hash like lists)."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def cached_stage(stage, key, compute, cache_dir=PIPELINE_CACHE_DIR):
+    """Return (output, hit): the stored output for ``key`` or ``compute()``, stored."""
+    path = os.path.join(cache_dir, f"{stage}-{key[:32]}.joblib")
+    if cache_dir and os.path.exists(path):
+        print(f"✅ {stage}: reusing cached output ({key[:12]})")
+        return joblib.load(path), True
+
+    output = compute()
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        joblib.dump(output, tmp_path)
+        os.replace(tmp_path, path)
+    return output, False
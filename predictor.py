@@ -1,17 +1,177 @@
 # predictor.py
+import json
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
 import pandas as pd
 import numpy as np
-from preprocessing import transform_with_preprocessor
-from similarity import find_similarity_for_input
+from preprocessing import transform_with_preprocessor, normalize_frame, normalize_value
+from similarity import find_similarity_for_batch, similarity_info
+from config import PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL
+
+def predict_many(model, rows_df, preproc,
+                 min_cat_matches=3, text_threshold=0.6):
+    """Price a batch of products in one pass.
+
+    The batch is normalized (see ``normalize_row``), transformed once,
+    gated against the training set as a whole and sent to
+    ``model.predict`` in a single call. Rows that fail
+    the similarity gate get a NaN price instead of aborting the batch.
+    Returns (prices, info) where ``info`` is a DataFrame with one row per
+    input row: is_similar, max_cat_matches, max_text_similarity.
+    """
+    df_in = normalize_frame(pd.DataFrame(rows_df).reset_index(drop=True), preproc['cat_cols'])
+    X_in_full, _, X_in_svd = transform_with_preprocessor(df_in, preproc)
+
+    is_similar, max_cat, max_sim = find_similarity_for_batch(
+        X_in_full, X_in_svd, preproc, min_cat_matches, text_threshold
+    )
+
+    prices = np.full(len(df_in), np.nan)
+    if is_similar.any():
+        pred_log = model.predict(X_in_full[is_similar])
+        prices[is_similar] = np.expm1(pred_log)
+
+    info = pd.DataFrame({
+        'is_similar': is_similar,
+        'max_cat_matches': max_cat,
+        'max_text_similarity': max_sim,
+    })
+    return prices, info
 
 def predict_with_similarity_check(model, input_row, preproc,
-                                  min_cat_matches=3, text_threshold=0.6):
-    similar, info = find_similarity_for_input(input_row, preproc,
-                                              min_cat_matches, text_threshold)
-    if not similar:
+                                  min_cat_matches=3, text_threshold=0.6, cache=None):
+    """Price one product; raises ValueError when it fails the similarity gate.
+
+    The row is normalized first (see ``normalize_row``), with or without
+    a cache. With a ``PredictionCache`` both prices and gate rejections are
+    served from the cache while the model/preproc version is unchanged.
+    """
+    input_row = normalize_row(input_row, preproc['cat_cols'])
+    if cache is not None:
+        key = prediction_key(input_row, min_cat_matches, text_threshold)
+        version = model_version(model, preproc)
+        hit = cache.get(key, version)
+        if hit is None:
+            hit = _predict_one(model, input_row, preproc, min_cat_matches, text_threshold)
+            cache.put(key, version, hit)
+    else:
+        hit = _predict_one(model, input_row, preproc, min_cat_matches, text_threshold)
+
+    price, info = hit
+    if price is None:
         raise ValueError("No similar product found in training dataset. Prediction aborted.")
+    return price, dict(info)
+
+def _predict_one(model, input_row, preproc, min_cat_matches, text_threshold):
+    # (price, similarity info); price is None for rows rejected by the gate
+    prices, info = predict_many(model, [input_row], preproc,
+                                min_cat_matches, text_threshold)
+    price = float(prices[0]) if info['is_similar'].iloc[0] else None
+    return price, similarity_info(info['max_cat_matches'].iloc[0],
+                                  info['max_text_similarity'].iloc[0])
+
+
+# ------------------------------
+# Prediction cache
+# ------------------------------
+def normalize_row(input_row, cat_cols):
+    """Lower-case and collapse whitespace in the category values and description.
+
+    ``fit_preprocessor`` normalizes the training data the same way (see
+    ``preprocessing.normalize_frame``), so rows that only differ in case or
+    spacing get the same features (and the same cache entry).
+    """
+    row = dict(input_row)
+    for c in list(cat_cols) + ['description']:
+        if c in row:
+            row[c] = normalize_value(row[c])
+    return row
+
+def prediction_key(row, min_cat_matches=3, text_threshold=0.6):
+    payload = {k: (None if pd.isna(v) else str(v)) for k, v in sorted(row.items()) if k != 'price'}
+    payload['_gate'] = [min_cat_matches, text_threshold]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def model_version(model, preproc):
+    """Version tag of a (model, preproc) pair, for cache invalidation.
+
+    Each side gets a random id the first time it is seen (``fit_preprocessor``
+    assigns the preproc one); artifacts store both so every process serving
+    the same artifact shares the tag, and any reload of a different model
+    changes it.
+    """
+    if not preproc.get('version'):
+        preproc['version'] = uuid.uuid4().hex
+    if not getattr(model, 'version_', None):
+        model.version_ = uuid.uuid4().hex
+    return f"{model.version_}:{preproc['version']}"
+
+class PredictionCache:
+    """Bounded LRU cache of single-row prediction results.
+
+    Entries expire after ``ttl`` seconds (None = never). The cache is tied
+    to one model version: a lookup or store under a different version
+    drops every entry first. Thread-safe.
+    """
+
+    def __init__(self, max_size=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
-    df_in = pd.DataFrame([input_row])
-    X_in_full, _, _ = transform_with_preprocessor(df_in, preproc)
-    pred_log = model.predict(X_in_full)
-    return np.expm1(pred_log)[0], info
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -1,32 +1,37 @@
 # preprocessing.py
+import uuid
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+from similarity_index import SimilarityIndex, CategoryIndex
+from category_encoder import CategoryEncoder
+from text_embedder import TextEmbedder
 from config import TFIDF_MAX_FEATURES, TFIDF_NGRAM, SVD_COMPONENTS, CARDINALITY_MIN_FREQ, RANDOM_STATE
+from config import SIMILARITY_INDEX_MODE, SIMILARITY_N_PROBE, SIMILARITY_PRECISION, FEATURE_DTYPE
+from config import HASHING_N_FEATURES, STREAMING_SVD_ITER, EMBEDDER_MAX_ROWS
 
 def fit_preprocessor(df):   ##  learns mappings + TF-IDF + SVD from training data.
-    df = df.copy()
-    df['description'] = df['description'].fillna('').astype(str)
     cat_cols = ['product_type', 'material', 'color', 'style', 'region']
+    # same keys as inference, which normalizes its rows the same way
+    df = normalize_frame(df, cat_cols)
+    df['description'] = df['description'].fillna('').astype(str)
 
     # rare category reduction
-    cat_maps = {}
-    for c in cat_cols:
-        vc = df[c].fillna('unknown').astype(str).value_counts()
-        allowed = vc[vc >= CARDINALITY_MIN_FREQ].index.tolist()
-        if '__other__' not in allowed:
-            allowed.append('__other__')
-        df[c] = df[c].apply(lambda x: x if x in allowed else '__other__')
-        df[c] = df[c].astype('category')
-        cat_maps[c] = allowed
+    encoder = CategoryEncoder(cat_cols, min_freq=CARDINALITY_MIN_FREQ).fit(df)
+    cat_maps = encoder.cat_maps
+    cat_codes = np.column_stack([encoder.encode(df[c], c, fit=True) for c in cat_cols])
+    for j, c in enumerate(cat_cols):
+        df[c] = _present_categories(cat_codes[:, j], encoder.vocab[c])
 
     # TF-IDF + SVD
     tfidf = TfidfVectorizer(max_features=TFIDF_MAX_FEATURES, ngram_range=TFIDF_NGRAM)
     X_tfidf = tfidf.fit_transform(df['description'])
     n_svd = min(SVD_COMPONENTS, X_tfidf.shape[1], max(1, df.shape[0]-1))
     svd = TruncatedSVD(n_components=n_svd, random_state=RANDOM_STATE)
-    X_svd = svd.fit_transform(X_tfidf)
+    X_svd = svd.fit_transform(X_tfidf).astype(FEATURE_DTYPE, copy=False)
 
     svd_cols = [f"svd_{i}" for i in range(X_svd.shape[1])]
     df_svd = pd.DataFrame(X_svd, columns=svd_cols, index=df.index)
@@ -37,28 +42,226 @@ def fit_preprocessor(df):   ##  learns mappings + TF-IDF + SVD from training dat
         'svd': svd,
         'cat_cols': cat_cols,
         'cat_maps': cat_maps,
+        'cat_encoder': encoder,
         'X_tfidf_matrix': X_tfidf,
         'X_svd_array': X_svd,
-        'X_full_df': X_full
+        'X_full_df': X_full,
+        'sim_index': SimilarityIndex(X_svd, mode=SIMILARITY_INDEX_MODE, n_probe=SIMILARITY_N_PROBE,
+                                     precision=SIMILARITY_PRECISION),
+        'cat_index': CategoryIndex(cat_codes, [len(cat_maps[c]) for c in cat_cols]),
+        'version': uuid.uuid4().hex
     }
 
-def transform_with_preprocessor(df, preproc):   ## applies same transformations to test or new data
+def normalize_frame(df, cat_cols):
+    """Lower-case and collapse whitespace in the category values and description (returns a copy).
+
+    Applied to training data here and to inference rows by the predictor,
+    so values that only differ in case or spacing map to the same category
+    (and the same prediction cache entry).
+    """
+    df = df.copy()
+    for c in list(cat_cols) + ['description']:
+        if c in df.columns:
+            df[c] = df[c].map(normalize_value)
+    return df
+
+def normalize_value(v):
+    return " ".join(v.split()).lower() if isinstance(v, str) else v
+
+def transform_with_preprocessor(df, preproc, use_embedder=None):   ## applies same transformations to test or new data
+    # Small batches (<= EMBEDDER_MAX_ROWS rows, or use_embedder=True) are
+    # embedded with the fused TextEmbedder; X_tfidf is None in that case.
     df = df.copy()
     df['description'] = df['description'].fillna('').astype(str)
-    cat_cols = preproc['cat_cols']
 
-    for c in cat_cols:
-        df[c] = df[c].fillna('unknown').astype(str)
-        allowed = preproc['cat_maps'][c]
-        df[c] = df[c].apply(lambda x: x if x in allowed else '__other__')
-        df[c] = pd.Categorical(df[c], categories=allowed)
+    df_cat = get_category_encoder(preproc).transform(df)
 
-    X_tfidf = preproc['tfidf'].transform(df['description'])
-    X_svd = preproc['svd'].transform(X_tfidf)
+    if use_embedder is None:
+        use_embedder = len(df) <= EMBEDDER_MAX_ROWS
+    if use_embedder:
+        X_tfidf = None
+        X_svd = get_text_embedder(preproc).transform(df['description']).astype(FEATURE_DTYPE, copy=False)
+    else:
+        X_tfidf = preproc['tfidf'].transform(df['description'])
+        X_svd = preproc['svd'].transform(X_tfidf).astype(FEATURE_DTYPE, copy=False)
     svd_cols = [f"svd_{i}" for i in range(X_svd.shape[1])]
     df_svd = pd.DataFrame(X_svd, columns=svd_cols, index=df.index)
 
-    X_full = pd.concat([df[cat_cols], df_svd], axis=1)
+    X_full = pd.concat([df_cat, df_svd], axis=1)
     return X_full, X_tfidf, X_svd
 
+def get_category_encoder(preproc):
+    # preprocessors pickled before CategoryEncoder existed only carry cat_maps
+    if preproc.get('cat_encoder') is None:
+        preproc['cat_encoder'] = CategoryEncoder.from_cat_maps(preproc['cat_cols'], preproc['cat_maps'])
+    return preproc['cat_encoder']
+
+def get_text_embedder(preproc):
+    # derived from tfidf + svd, so it is built on first use rather than stored
+    if preproc.get('text_embedder') is None:
+        preproc['text_embedder'] = TextEmbedder(preproc['tfidf'], preproc['svd'])
+    return preproc['text_embedder']
+
+def _present_categories(codes, vocab):
+    # the categorical astype('category') used to give the training frame:
+    # only the values that occur, in sorted order
+    present = np.flatnonzero(np.bincount(codes, minlength=len(vocab)))
+    cats = vocab[present]
+    order = cats.argsort()
+    remap = np.full(len(vocab), -1, dtype=codes.dtype)
+    remap[present[order]] = np.arange(len(present), dtype=codes.dtype)
+    return pd.Categorical.from_codes(remap[codes], categories=cats[order])
+
+
+class HashingTfidfVectorizer:
+    """TF-IDF over hashed n-grams, fitted incrementally.
+
+    ``partial_fit`` only accumulates per-bucket term and document
+    frequencies, so the vocabulary never has to be held in memory.
+    ``finalize`` keeps the ``max_features`` most frequent buckets (as
+    ``TfidfVectorizer`` keeps the most frequent terms) and computes smoothed
+    IDF the same way. ``transform`` matches ``TfidfVectorizer.transform``:
+    raw counts x IDF, L2-normalized rows.
+    """
+
+    def __init__(self, max_features=TFIDF_MAX_FEATURES, ngram_range=TFIDF_NGRAM,
+                 n_buckets=HASHING_N_FEATURES):
+        self.max_features = max_features
+        self.ngram_range = tuple(ngram_range)
+        self.n_buckets = n_buckets
+        self.hasher = HashingVectorizer(n_features=n_buckets, ngram_range=self.ngram_range,
+                                        alternate_sign=False, norm=None)
+        self.n_docs = 0
+        self.term_counts = None
+        self.doc_counts = None
+
+    @classmethod
+    def from_fitted(cls, columns, idf, max_features, ngram_range, n_buckets):
+        vec = cls(max_features, ngram_range, n_buckets)
+        vec.columns_ = np.asarray(columns)
+        vec.idf_ = np.asarray(idf)
+        vec._build_selector()
+        return vec
+
+    def partial_fit(self, docs):
+        if self.term_counts is None:
+            self.term_counts = np.zeros(self.n_buckets, dtype=np.float64)
+            self.doc_counts = np.zeros(self.n_buckets, dtype=np.int64)
+        X = self.hasher.transform(docs)
+        self.n_docs += X.shape[0]
+        self.term_counts += np.asarray(X.sum(axis=0)).ravel()
+        self.doc_counts += np.bincount(X.indices, minlength=self.n_buckets)
+        return self
+
+    def finalize(self):
+        seen = np.flatnonzero(self.term_counts)
+        keep = seen[np.argsort(-self.term_counts[seen], kind='stable')[:self.max_features]]
+        self.columns_ = np.sort(keep)
+        df = self.doc_counts[self.columns_]
+        self.idf_ = np.log((1 + self.n_docs) / (1 + df)) + 1
+        self._build_selector()
+        # the frequency tables are only needed while fitting
+        self.term_counts = self.doc_counts = None
+        return self
+
+    def _build_selector(self):
+        # bucket -> kept column, applied as one sparse product
+        k = len(self.columns_)
+        self.selector_ = sp.csr_matrix(
+            (np.ones(k), (self.columns_, np.arange(k))), shape=(self.n_buckets, k)
+        )
+
+    def transform(self, docs):
+        X = self.hasher.transform(docs) @ self.selector_
+        X = X @ sp.diags(self.idf_)
+        return normalize(X.tocsr(), norm='l2', copy=False)
+
 
+def _streaming_svd(chunks, tfidf, n_components, n_iter=STREAMING_SVD_ITER,
+                   random_state=RANDOM_STATE):
+    # Subspace iteration on X^T X, accumulated chunk by chunk: each pass
+    # computes Z = sum_c X_c^T (X_c Q) and Q^T Z, so only the chunk and a
+    # (n_features x n_components+10) block are in memory. The last pass'
+    # Q^T X^T X Q gives the right singular vectors by Rayleigh-Ritz.
+    rng = np.random.RandomState(random_state)
+    n_features = len(tfidf.idf_)
+    width = min(n_features, n_components + 10)
+    Q, _ = np.linalg.qr(rng.normal(size=(n_features, width)))
+    for _ in range(max(1, n_iter)):
+        Z = np.zeros((n_features, width))
+        for chunk in chunks():
+            X = tfidf.transform(chunk['description'].fillna('').astype(str))
+            Z += X.T @ (X @ Q)
+        B = Q.T @ Z
+        Q_next, _ = np.linalg.qr(Z)
+        Q_prev, Q = Q, Q_next
+
+    eigvals, eigvecs = np.linalg.eigh((B + B.T) / 2)
+    order = np.argsort(eigvals)[::-1][:n_components]
+    components = (Q_prev @ eigvecs[:, order]).T
+
+    svd = TruncatedSVD(n_components=n_components, random_state=random_state)
+    svd.components_ = components
+    svd.n_features_in_ = n_features
+    svd.singular_values_ = np.sqrt(np.clip(eigvals[order], 0, None))
+    return svd
+
+def fit_preprocessor_streaming(chunks):   ## out-of-core fit_preprocessor
+    """Fit a preprocessor from a dataset that does not fit in memory.
+
+    ``chunks`` is a zero-argument callable returning a fresh iterator of
+    DataFrames (e.g. ``lambda: iter_dataset(path, chunksize)``); it is
+    iterated once for category/term statistics, ``STREAMING_SVD_ITER`` times
+    for the SVD and once more to project the training rows. Working memory
+    is bounded by the chunk size, apart from the per-row outputs
+    (SVD features and category codes).
+    """
+    cat_cols = ['product_type', 'material', 'color', 'style', 'region']
+    raw_chunks = chunks
+
+    def chunks():
+        return (normalize_frame(chunk, cat_cols) for chunk in raw_chunks())
+
+    # pass 1: category counts + hashed term/document frequencies
+    tfidf = HashingTfidfVectorizer()
+    counts = {c: pd.Series(dtype=np.int64) for c in cat_cols}
+    for chunk in chunks():
+        tfidf.partial_fit(chunk['description'].fillna('').astype(str))
+        for c in cat_cols:
+            counts[c] = counts[c].add(CategoryEncoder.value_counts(chunk[c]), fill_value=0)
+    tfidf.finalize()
+    counts = {c: vc.sort_values(ascending=False, kind='stable') for c, vc in counts.items()}
+    encoder = CategoryEncoder(cat_cols, min_freq=CARDINALITY_MIN_FREQ).fit_counts(counts)
+    cat_maps = encoder.cat_maps
+
+    # passes 2..n: randomized SVD of the TF-IDF matrix
+    n_svd = min(SVD_COMPONENTS, len(tfidf.idf_), max(1, tfidf.n_docs - 1))
+    svd = _streaming_svd(chunks, tfidf, n_svd)
+
+    # last pass: project the training rows
+    svd_parts, code_parts = [], []
+    for chunk in chunks():
+        X = tfidf.transform(chunk['description'].fillna('').astype(str))
+        svd_parts.append(svd.transform(X).astype(FEATURE_DTYPE, copy=False))
+        code_parts.append(np.column_stack([encoder.encode(chunk[c], c, fit=True) for c in cat_cols]))
+    X_svd = np.vstack(svd_parts)
+    cat_codes = np.vstack(code_parts)
+
+    svd_cols = [f"svd_{i}" for i in range(X_svd.shape[1])]
+    df_cat = pd.DataFrame({c: _present_categories(cat_codes[:, j], encoder.vocab[c])
+                           for j, c in enumerate(cat_cols)})
+    X_full = pd.concat([df_cat, pd.DataFrame(X_svd, columns=svd_cols)], axis=1)
+
+    return {
+        'tfidf': tfidf,
+        'svd': svd,
+        'cat_cols': cat_cols,
+        'cat_maps': cat_maps,
+        'cat_encoder': encoder,
+        'X_svd_array': X_svd,
+        'X_full_df': X_full,
+        'sim_index': SimilarityIndex(X_svd, mode=SIMILARITY_INDEX_MODE, n_probe=SIMILARITY_N_PROBE,
+                                     precision=SIMILARITY_PRECISION),
+        'cat_index': CategoryIndex(cat_codes, [len(cat_maps[c]) for c in cat_cols]),
+        'version': uuid.uuid4().hex
+    }
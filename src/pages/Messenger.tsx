@@ -37,6 +37,9 @@ export default function Messenger() {
   const [messages, setMessages] = useState<Message[]>([]);
   const [message, setMessage] = useState("");
   const [aiSuggestion, setAiSuggestion] = useState<string | null>(null);
+  // suggestion_id of the suggestion being streamed, and of one the artisan already used or cleared
+  const streamingSuggestionId = useRef<string | null>(null);
+  const dismissedSuggestionId = useRef<string | null>(null);
   const webSocket = useRef<WebSocket | null>(null);
 
   // --- Mock Data for UI sidebar ---
@@ -83,8 +86,29 @@ export default function Messenger() {
           timestamp: new Date(data.timestamp).toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' })
         };
         setMessages((prevMessages) => [...prevMessages, newMessage]);
-      } else if (data.type === 'suggestion') {
-        setAiSuggestion(data.text);
+      } else if (data.type === 'suggestion_delta' || data.type === 'suggestion') {
+        // later chunks of a suggestion that was already used or cleared stay hidden
+        if (data.suggestion_id && data.suggestion_id === dismissedSuggestionId.current) return;
+        if (data.type === 'suggestion') {
+          // the complete text; replaces whatever was streamed
+          streamingSuggestionId.current = null;
+          setAiSuggestion(data.text);
+        } else if (data.suggestion_id === streamingSuggestionId.current) {
+          setAiSuggestion((prev) => (prev ?? '') + data.text);
+        } else {
+          // first chunk of a new suggestion
+          streamingSuggestionId.current = data.suggestion_id;
+          setAiSuggestion(data.text);
+        }
+      } else if (data.type === 'suggestion_cancelled') {
+        // a newer message superseded it; the next suggestion streams in fresh
+        if (data.suggestion_id === streamingSuggestionId.current) {
+          streamingSuggestionId.current = null;
+          setAiSuggestion(null);
+        }
+      } else if (data.type === 'ping') {
+        // heartbeat: lets the server tell a quiet tab from a dead connection
+        socket.send(JSON.stringify({ type: 'pong' }));
       }
     };
 
@@ -111,14 +135,20 @@ export default function Messenger() {
       };
       setMessages((prevMessages) => [...prevMessages, optimisticMessage]);
       setMessage("");
-      setAiSuggestion(null);
+      dismissSuggestion();
     }
   };
 
+  const dismissSuggestion = () => {
+    dismissedSuggestionId.current = streamingSuggestionId.current;
+    streamingSuggestionId.current = null;
+    setAiSuggestion(null);
+  };
+
   const handleSuggestionClick = () => {
     if (aiSuggestion) {
       setMessage(aiSuggestion);
-      setAiSuggestion(null);
+      dismissSuggestion();
     }
   };
 
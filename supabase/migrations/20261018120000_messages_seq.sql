@@ -0,0 +1,10 @@
+-- Database-assigned message order for "messages since" fetches.
+-- Chat workers write messages behind the delivery path, so created_at (set by
+-- the worker) can be older than rows other workers have already read past.
+-- seq is assigned on insert, not on commit, so readers still re-read a few
+-- seconds of rows behind their cursor and drop duplicates by id.
+ALTER TABLE public.messages
+ADD COLUMN IF NOT EXISTS seq BIGINT GENERATED ALWAYS AS IDENTITY;
+
+CREATE INDEX IF NOT EXISTS messages_conversation_seq_idx
+ON public.messages (conversation_id, seq);